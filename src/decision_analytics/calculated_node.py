@@ -2,15 +2,53 @@ from decision_analytics import Node
 
 
 class CalculatedNode(Node):
+    __slots__ = ()
+
     def __init__(self, definition: str, **kwargs):
-        super().__init__(**kwargs)
-        self.definition = definition
         assert (
             kwargs.get("node_type") == "calculation"
-        ), f"Relation node must be calculation type, got {kwargs.get('node_type')} for node {self.name}"
+        ), f"Relation node must be calculation type, got {kwargs.get('node_type')} for node {kwargs.get('name')}"
         # pass rest to node init
+        super().__init__(**kwargs)
+        self.definition = definition
         self.rank = 1
 
+    @property
+    def definition(self) -> str:
+        """
+        The definition of the node. Changing it in a collection updates the collection's
+        dependency graph, ranks and evaluation plan, and marks the node and everything
+        downstream of it as stale.
+        """
+        return self._store.definition[self._idx]
+
+    @definition.setter
+    def definition(self, definition: str):
+        self._store.definition[self._idx] = definition
+        if self._collection is not None:
+            self._collection._redefine(self.name)
+
+    @property
+    def value(self):
+        """
+        The value of the node. In a lazy collection, reading a stale value first evaluates
+        this node and its stale ancestors.
+        """
+        collection = self._collection
+        if (
+            collection is not None
+            and collection.lazy
+            and self.name in collection._stale
+        ):
+            collection._pull(self.name)
+        # Same as Node.value, inlined as it is read for every node of a model
+        value = self._store.value.item(self._idx)
+        return None if value != value else value
+
+    @value.setter
+    def value(self, new_value):
+        Node.value.fset(self, new_value)
+
     def __repr__(self):
         node_description = f"{self.name} (Type: {self.node_type}, Definition: {self.definition}, Value:{self._pretty_value()}, Rank: {self.rank})"
         return node_description
@@ -0,0 +1,206 @@
+class DependencyGraph:
+    """
+    Dependencies between the nodes of a collection.
+
+    The graph is kept up to date by NodesCollection as nodes are added and removed, so that
+    definitions only need to be tokenized once. Each node maps to the names of the nodes its
+    definition references (its parents), and the reverse edges (children) are kept alongside.
+    Nodes without children have no entry in `children`, so that the many leaf nodes of a large
+    model do not each hold an empty set.
+
+    Transitive closures are computed on first ancestor or descendant query after a change, and
+    stored as bitsets (Python integers with one bit per node, in topological order), so that
+    these queries cost O(k) in the size of the answer. Change tracking uses downstream instead,
+    which walks the edges without building the closures.
+    """
+
+    def __init__(self):
+        self.parents = {}
+        self.children = {}
+        self.inputs = set()
+        self._closures = None
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.parents
+
+    def set_node(self, name: str, parents: list, is_input: bool = False) -> None:
+        """Add a node to the graph, replacing its previous edges if it already exists.
+
+        Parameters
+        ----------
+        name : str
+            Name of the node.
+        parents : list
+            Names of the nodes referenced by the node's definition, empty for input nodes.
+        is_input : bool, optional
+            Whether the node is an input node, by default False.
+        """
+        if name in self.parents:
+            self.remove_node(name)
+        self._closures = None
+        # Input nodes share the empty tuple
+        self.parents[name] = tuple(parents)
+        for parent in parents:
+            self.children.setdefault(parent, set()).add(name)
+        if is_input:
+            self.inputs.add(name)
+
+    def remove_node(self, name: str) -> None:
+        """Remove a node and the edges to its parents. Edges from its children are kept."""
+        for parent in self.parents.pop(name):
+            self.children[parent].discard(name)
+        self.inputs.discard(name)
+        self._closures = None
+
+    def rank(self, names=None, known_ranks=None) -> dict:
+        """Rank nodes of the graph in topological order.
+
+        Input nodes have rank 0, and every other node has rank one more than the highest ranked
+        of its parents (or 1 without parents). The ranking is done in O(V+E) with Kahn's algorithm,
+        or in time proportional to the subset and its edges when ranking a subset.
+
+        Parameters
+        ----------
+        names : Optional[Iterable[str]], optional
+            Names of the nodes to rank, by default None ranks the whole graph. A subset must
+            include everything downstream of it, as nodes outside it are not re-ranked.
+        known_ranks : Optional[Callable[[str], int]], optional
+            Function giving the current rank of nodes outside the subset. Required when `names`
+            is given.
+
+        Returns
+        -------
+        dict
+            Dictionary of node name to rank. Nodes that depend on a cycle or on a missing node
+            cannot be ranked and are left out.
+        """
+        subset = self.parents.keys() if names is None else set(names)
+        ranks = {}
+        indegree = {}
+        queue = []
+        for name in subset:
+            if name in self.inputs:
+                ranks[name] = 0
+                continue
+            rank = 1
+            count = 0
+            for parent in self.parents[name]:
+                if parent in subset:
+                    count += parent not in self.inputs
+                elif parent in self.parents:
+                    rank = max(rank, known_ranks(parent) + 1)
+                else:
+                    # Missing node, never resolved
+                    count += 1
+            ranks[name] = rank
+            indegree[name] = count
+            if count == 0:
+                queue.append(name)
+
+        unranked = set(indegree)
+        while queue:
+            name = queue.pop()
+            unranked.discard(name)
+            for child in self.children.get(name, ()):
+                if child in indegree:
+                    ranks[child] = max(ranks[child], ranks[name] + 1)
+                    indegree[child] -= 1
+                    if indegree[child] == 0:
+                        queue.append(child)
+
+        for name in unranked:
+            del ranks[name]
+        return ranks
+
+    def downstream(self, names) -> set:
+        """Get the names of all nodes depending on any of `names`, directly or indirectly.
+
+        This walks the edges instead of using the closures, so it costs time proportional to
+        the nodes found and needs no closure of the whole graph, which takes O(V^2) memory.
+        """
+        found = set()
+        pending = list(names)
+        while pending:
+            for child in self.children.get(pending.pop(), ()):
+                if child not in found:
+                    found.add(child)
+                    pending.append(child)
+        return found
+
+    def find_cycle(self, unranked: set) -> list:
+        """Find the dependency path that prevents nodes from being ranked.
+
+        Parameters
+        ----------
+        unranked : set
+            Names of the nodes left out of the ranking.
+
+        Returns
+        -------
+        list
+            Path of node names, each depending on the next one. The path either ends with its
+            first node repeated (a cycle), or with the name of a node missing from the graph.
+        """
+        path = [next(iter(sorted(unranked)))]
+        seen = {path[0]: 0}
+        while True:
+            name = path[-1]
+            if name not in self.parents:
+                return path
+            parent = next(
+                parent
+                for parent in self.parents[name]
+                if parent in unranked or parent not in self.parents
+            )
+            if parent in seen:
+                return path[seen[parent] :] + [parent]
+            seen[parent] = len(path)
+            path.append(parent)
+
+    def _get_closures(self):
+        """Compute the ancestor and descendant bitsets of every node, if the graph changed."""
+        if self._closures is None:
+            ranks = self.rank()
+            names = sorted(ranks, key=ranks.get)
+            bits = {name: 1 << i for i, name in enumerate(names)}
+            ancestors = {}
+            for name in names:
+                closure = 0
+                for parent in self.parents[name]:
+                    closure |= bits[parent] | ancestors[parent]
+                ancestors[name] = closure
+            descendants = {}
+            for name in reversed(names):
+                closure = 0
+                for child in self.children.get(name, ()):
+                    if child in bits:
+                        closure |= bits[child] | descendants[child]
+                descendants[name] = closure
+            input_mask = sum(bits[name] for name in self.inputs)
+            self._closures = (names, ancestors, descendants, input_mask)
+        return self._closures
+
+    @staticmethod
+    def _decode(names: list, closure: int) -> list:
+        """Get the names of the nodes set in a bitset, in topological order."""
+        found = []
+        while closure:
+            lowest = closure & -closure
+            found.append(names[lowest.bit_length() - 1])
+            closure ^= lowest
+        return found
+
+    def ancestors(self, name: str) -> list:
+        """Get the names of all nodes `name` depends on, directly or indirectly, in topological order."""
+        names, ancestors, _, _ = self._get_closures()
+        return self._decode(names, ancestors[name])
+
+    def descendants(self, name: str) -> list:
+        """Get the names of all nodes depending on `name`, directly or indirectly, in topological order."""
+        names, _, descendants, _ = self._get_closures()
+        return self._decode(names, descendants[name])
+
+    def inputs_affecting(self, name: str) -> list:
+        """Get the names of the input nodes `name` depends on, in topological order."""
+        names, ancestors, _, input_mask = self._get_closures()
+        return self._decode(names, ancestors[name] & input_mask)
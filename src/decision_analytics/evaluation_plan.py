@@ -0,0 +1,203 @@
+import logging
+import re
+import time
+from typing import Optional
+
+import numpy as np
+
+from decision_analytics import CalculatedNode
+from decision_analytics.node_store import NodeStore
+from decision_analytics.optimizer import FusedEvaluator
+from decision_analytics.tracing import Tracer
+
+# Number of fused evaluators cached by a plan
+_MAX_FUSED_EVALUATORS = 32
+
+
+def definition_variables(definition: str) -> list:
+    """Get the names of the nodes referenced by a definition, in order of first appearance.
+
+    Numeric literals are not node references and are left out.
+    """
+    variables = []
+    for var in re.findall(r"\b\w+\b", definition):
+        if not var.isdigit() and var not in variables:
+            variables.append(var)
+    return variables
+
+
+def compile_definition(name: str, definition: str, variables: list):
+    """Compile a node definition into a function taking its variables as positional arguments.
+
+    Parameters
+    ----------
+    name : str
+        Name of the node, used as the filename of the compiled code for tracebacks.
+    definition : str
+        Arithmetic definition of the node, e.g. "total_users * subscribe_rate".
+    variables : list
+        Names of the nodes referenced by the definition, in argument order.
+
+    Returns
+    -------
+    Callable
+        Function evaluating the definition. Builtins are not available to the function.
+    """
+    source = f"lambda {', '.join(variables)}: ({definition})"
+    code = compile(source, f"<{name}>", "eval")
+    return eval(code, {"__builtins__": None})
+
+
+class EvaluationPlan:
+    """
+    A compiled evaluation plan for the calculated nodes of a collection.
+
+    The plan is built once from the ranked nodes: each definition is compiled into a function,
+    its dependencies are resolved into rows of the node store, and the calculated nodes are laid
+    out in evaluation order. Running the plan is then a straight-line pass over the store's
+    value column.
+
+    The plan holds the store rows of the nodes it was built from, so it must be rebuilt
+    whenever nodes are added, replaced or removed. NodesCollection takes care of this.
+    """
+
+    def __init__(self, nodes: dict, dependencies: dict, store: NodeStore):
+        """Build the plan
+
+        Parameters
+        ----------
+        nodes : dict
+            Dictionary of node name to node, already sorted by rank.
+        dependencies : dict
+            Dictionary of node name to the names of the nodes referenced by its definition.
+        store : NodeStore
+            The store holding the attributes of all the nodes.
+        """
+        self.store = store
+        self.rows = np.array([node._idx for node in nodes.values()], dtype=np.intp)
+        self.order = []
+        self.dependencies = {}
+        self.functions = {}
+        self.definitions = {}
+        self._fused = {}
+        self._steps = []
+        self._positions = {}
+        self.has_kpi = any(node.is_kpi for node in nodes.values())
+        for node in nodes.values():
+            if not isinstance(node, CalculatedNode):
+                continue
+            variables = dependencies[node.name]
+            function = compile_definition(node.name, node.definition, variables)
+            self.order.append(node.name)
+            self.dependencies[node.name] = list(variables)
+            self.functions[node.name] = function
+            self.definitions[node.name] = node.definition
+            self._positions[node.name] = len(self._steps)
+            self._steps.append(
+                (node._idx, function, tuple(nodes[var]._idx for var in variables))
+            )
+
+    def __len__(self):
+        return len(self._steps)
+
+    def fused_evaluator(
+        self, outputs: list, constants: Optional[dict] = None
+    ) -> FusedEvaluator:
+        """Get a fused evaluator of the given output nodes, compiling it on first use.
+
+        Parameters
+        ----------
+        outputs : list
+            Names of the nodes to evaluate.
+        constants : Optional[dict], optional
+            Dictionary of input name to fixed value, folded into the evaluator, by default None.
+
+        Returns
+        -------
+        FusedEvaluator
+            Single function evaluating the outputs from the input nodes, with intermediate
+            nodes inlined, common subexpressions eliminated and constant subgraphs folded.
+        """
+        constants = constants or {}
+        key = (tuple(outputs), tuple(sorted(constants.items())))
+        if key not in self._fused:
+            if len(self._fused) >= _MAX_FUSED_EVALUATORS:
+                # Constants change with node values, don't let stale evaluators pile up
+                self._fused.clear()
+            self._fused[key] = FusedEvaluator(self.definitions, outputs, constants)
+        return self._fused[key]
+
+    def run(self, names=None, tracer: Optional[Tracer] = None) -> None:
+        """Evaluate calculated nodes in order, updating the node values in the store.
+
+        Parameters
+        ----------
+        names : Optional[Iterable[str]], optional
+            Names of the calculated nodes to evaluate, by default None evaluates all of them.
+            Nodes are always evaluated in plan order, whatever the order of `names`.
+        tracer : Optional[Tracer], optional
+            Tracer receiving evaluation events, by default None. Only used if enabled.
+        """
+        steps = self._steps
+        if names is not None:
+            steps = [steps[i] for i in sorted(self._positions[name] for name in names)]
+        values = self.store.value
+        if tracer is not None and tracer.enabled:
+            self._run_traced(steps, tracer)
+            return
+        for row, function, dependencies in steps:
+            try:
+                values[row] = function(*[values.item(dep) for dep in dependencies])
+            except Exception as e:
+                logging.error(f"Error evaluating node '{self.store.name[row]}': {e}")
+                raise
+
+    def _run_traced(self, steps: list, tracer: Tracer) -> None:
+        """Same as run, reporting each evaluation to the tracer."""
+        values = self.store.value
+        names = self.store.name
+        tracer.start()
+        for row, function, dependencies in steps:
+            inputs = {names[dep]: values.item(dep) for dep in dependencies}
+            start = time.perf_counter()
+            try:
+                values[row] = function(*inputs.values())
+            except Exception as e:
+                logging.error(f"Error evaluating node '{names[row]}': {e}")
+                raise
+            seconds = time.perf_counter() - start
+            tracer.node_evaluated(names[row], inputs, values.item(row), seconds)
+        tracer.finish()
+
+    def evaluate(self, values: dict, tracer: Optional[Tracer] = None) -> dict:
+        """Evaluate every calculated node from the given values, without touching the nodes.
+
+        The compiled definitions only use arithmetic operators, so values can be NumPy arrays,
+        in which case each definition is evaluated as a handful of vectorized operations.
+
+        Parameters
+        ----------
+        values : dict
+            Values of the input nodes, by name. Updated in place with the calculated values.
+        tracer : Optional[Tracer], optional
+            Tracer receiving evaluation events, by default None. Only used if enabled.
+
+        Returns
+        -------
+        dict
+            The values dictionary, with an entry added for each calculated node.
+        """
+        if tracer is not None and tracer.enabled:
+            tracer.start()
+            for name in self.order:
+                inputs = {var: values[var] for var in self.dependencies[name]}
+                start = time.perf_counter()
+                values[name] = self.functions[name](*inputs.values())
+                seconds = time.perf_counter() - start
+                tracer.node_evaluated(name, inputs, values[name], seconds)
+            tracer.finish()
+            return values
+        for name in self.order:
+            function = self.functions[name]
+            values[name] = function(*[values[var] for var in self.dependencies[name]])
+        return values
@@ -1,16 +1,35 @@
-import itertools
-import logging
+import hashlib
+import json
+import os
+from typing import Optional
 
 import numpy as np
 import pandas as pd
 
 from decision_analytics import NodesCollection
+from decision_analytics.aggregators import SwingCells, WeightedQuantileSketch
+from decision_analytics.parallel import evaluate_parallel
 from decision_analytics.plotting_utils import (
     plot_tornado,
     display_cdf_plot,
     display_pdf_plot,
     generate_cumulative_distribution_chart,
 )
+from decision_analytics.results import SimulationResult, _import_pyarrow
+from decision_analytics.simulation import (
+    expected_over_levels,
+    factorial_codes,
+    input_levels,
+    metalog_quantile,
+    one_at_a_time_codes,
+    ranged_inputs,
+    sample_uniform_blocks,
+    sample_uniforms,
+    scenario_radix,
+    scenario_values,
+    scenario_weights,
+)
+from decision_analytics.tracing import RecordingTracer
 from decision_analytics.utils import values_map
 from decision_analytics.metalogistic import MetaLogistic
 
@@ -25,11 +44,16 @@ class Funnel:
 
     There are two main methods:
     simulate_input_variance
-        This method creates a list of all possible combinations of input values, and evaluate all
-        funnel KPI nodes for each combination. This result is used to calculate input swings.
+        This method enumerates all possible combinations of input values as an array, and evaluates
+        all funnel KPI nodes for every combination in one vectorized batch. This result is used to calculate input swings.
     calculate_input_swing
         This method calculates the contribution of input swings of each input. This is done by
         evaluating the output values when all other factors are held at the median value.
+
+    For models with too many inputs to enumerate, simulate_inputs_swing calculates the same
+    swings from the 2n+1 one-at-a-time scenarios only, without the combined uncertainty, and
+    simulate_monte_carlo samples the inputs from continuous distributions instead of enumerating
+    their levels.
     """
 
     def __init__(self, nodes_collection: NodesCollection):
@@ -38,25 +62,79 @@ class Funnel:
             i.name for i in self.nodes_collection.get_input_nodes()
         ]
         self.kpi_node_names = [i.name for i in self.nodes_collection.get_kpi_nodes()]
-        self.sim_result = pd.DataFrame()
+        self.ranged_input_names = list(self.input_node_names)
+        self.kpi_tensors = {}
+        self.kpi_sketches = {}
+        self.results = None
+        self._sim_result = None
+
+    @property
+    def sim_result(self) -> pd.DataFrame:
+        """
+        Results of the last simulation as a dataframe, one row per scenario.
+
+        Simulations store their results compactly in self.results (see SimulationResult), and
+        the dataframe is only materialised from them on first access. Assigning a dataframe
+        drops the compact results, which no longer describe it.
+        """
+        if self._sim_result is None:
+            self._sim_result = (
+                pd.DataFrame() if self.results is None else self.results.to_frame()
+            )
+        return self._sim_result
+
+    @sim_result.setter
+    def sim_result(self, sim_result: pd.DataFrame) -> None:
+        self.results = None
+        self.kpi_tensors = {}
+        self._sim_result = sim_result
+
+    def _set_results(self, results: Optional[SimulationResult]) -> None:
+        self.results = results
+        self._sim_result = None
 
     def simulate(self) -> None:
         """
         Workflow to complete simulation, first simulating variance by each input's low/mid/high values.
         Then updates calculations based on these simulated variances for all KPIs.
         """
-        self.simulate_input_variance()
+        self._simulate_factorial()
         self.calculate_inputs_swing()
 
-    def simulate_input_variance(self) -> pd.DataFrame:
+    def simulate_input_variance(
+        self,
+        n_workers: Optional[int] = None,
+        chunk_size: int = 100000,
+        kpi_dtype: type = np.float64,
+    ) -> pd.DataFrame:
         """
-        Simulates all variations of the funnel by looping through all nodes and their value percentiles.
-        Stores the results in self.sim_result.
+        Simulates all variations of the funnel over every combination of the input nodes' value percentiles.
+        The combinations are generated as a grid of level codes, mapped to input values, and all KPIs
+        are evaluated for the whole grid at once. Stores the results in self.results as int8 level
+        codes and KPI arrays (see SimulationResult), from which self.sim_result is materialised,
+        and the results of each KPI as a tensor with one axis per ranged input in
+        self.kpi_tensors (see get_kpi_tensor).
+
+        With several workers, the scenarios are split in blocks of `chunk_size` and evaluated on
+        a process pool, see parallel.evaluate_parallel. The results are identical to the serial
+        evaluation.
+
+        Parameters
+        ----------
+        n_workers : Optional[int], optional
+            Number of worker processes, by default None evaluates in this process.
+        chunk_size : int, optional
+            Number of scenarios per task of the worker processes, by default 100000.
+        kpi_dtype : type, optional
+            Type the KPI results are stored as, by default np.float64. np.float32 halves
+            their size.
 
         Returns
         -------
         pd.DataFrame
             Result dataframe with all simulated scenarios (inputs x low/mid/high values).
+            Inputs without a range (or with a zero-width range) are not enumerated and
+            stay on their mid level in every scenario, see ranged_input_names.
             Dataframe is kept as instance property.
 
         Raises
@@ -64,50 +142,218 @@ class Funnel:
         ValueError
             If no KPI node is found in the funnel.
         """
-        # Given the nodes collection, simulate all the variation of the funnel by looping through all the nodes, and all the value percentiles of each node, and calculate the final outcome for each combination.
-
-        # Make sure that the nodes_collection has at least 1 calculated node tagged is_kpi=True
-        if not any(node.is_kpi for node in self.nodes_collection):
-            raise ValueError("No KPI node found in the funnel.")
+        self._simulate_factorial(n_workers, chunk_size, kpi_dtype)
+        return self.sim_result
 
+    def _simulate_factorial(
+        self,
+        n_workers: Optional[int] = None,
+        chunk_size: int = 100000,
+        kpi_dtype: type = np.float64,
+    ) -> None:
+        """Evaluate all combinations of the input levels into self.results, see simulate_input_variance."""
         inputs = self.input_node_names
-        possible_values = values_map.keys()
         kpis = self.kpi_node_names
+        levels, ranged = self._simulation_levels()
 
-        all_combinations = itertools.product(possible_values, repeat=len(inputs))
-
-        results = []
-        for combo in all_combinations:
-            input_labels = [f"{l}_value" for l in inputs]
-            combo_dict = dict(zip(inputs, combo))
-            self.nodes_collection.set_node_values_from_dict(combo_dict)
-            # rebuild combo_dict for logging, extract the values from actual inputs
-            values = [self.nodes_collection.get_node(i).value for i in inputs]
-            combo_dict_output = dict(zip(input_labels, values))
-            logging.debug(combo_dict)
-            logging.debug(self.nodes_collection.get_input_nodes())
-            self.nodes_collection.refresh_nodes()
-            kpi_values = [node.value for node in self.nodes_collection.get_kpi_nodes()]
-            results.append(
-                {
-                    **combo_dict_output,
-                    **{k: v for k, v in zip(kpis, kpi_values)},
-                    **combo_dict,
-                }
+        # Enumerate all combinations of the ranged inputs as level codes
+        codes = factorial_codes(len(self.ranged_input_names))
+
+        # Evaluate all KPIs for all combinations, in one batch or in blocks that workers
+        # decode themselves
+        constants = self._fixed_values(levels, ranged)
+        if n_workers is not None and n_workers > 1 and ranged.any():
+            batch = evaluate_parallel(
+                self.nodes_collection,
+                self.ranged_input_names,
+                levels[ranged],
+                constants,
+                kpis,
+                n_workers,
+                chunk_size,
+            )
+        else:
+            varying = self._ranged_values(levels, ranged, codes)
+            batch = self.nodes_collection.evaluate_batch(
+                {**varying, **constants}, outputs=kpis
             )
-        results_df = pd.DataFrame(results)
+            del varying
 
-        pr_mapping = {key: values["pr"] for key, values in values_map.items()}
-        results_df["weights"] = results_df[inputs].apply(
-            lambda row: row.map(pr_mapping).prod(), axis=1
+        results = SimulationResult(
+            inputs,
+            levels,
+            {
+                kpi: np.broadcast_to(batch[kpi], len(codes)).astype(kpi_dtype)
+                for kpi in kpis
+            },
+            codes=codes,
+            code_inputs=self.ranged_input_names,
         )
-
-        label_mapping = {key: values["label"] for key, values in values_map.items()}
-        results_df[inputs] = results_df[inputs].replace(label_mapping)
-        self.sim_result = results_df
+        self._set_results(results)
+        # One axis per ranged input, in factorial order, as views of the results
+        self.kpi_tensors = {kpi: results.tensor(kpi) for kpi in kpis}
         # Reset all input nodes to median value
         self.nodes_collection.reset_input_nodes()
-        return results_df
+
+    def trace_scenario(self, levels: dict) -> RecordingTracer:
+        """
+        Trace the evaluation of a single simulated scenario, for debugging.
+
+        Parameters
+        ----------
+        levels : dict
+            Dictionary with input node names as keys and level codes (0, 1 or 2, see values_map)
+            as values. Inputs left out are held at their mid value.
+
+        Returns
+        -------
+        RecordingTracer
+            Tracer holding the inputs, output and timing of each calculated node, in evaluation order.
+        """
+        inputs = self.input_node_names
+        codes = np.array([[levels.get(name, 1) for name in inputs]])
+        input_nodes = [self.nodes_collection.get_node(i) for i in inputs]
+        values = scenario_values(input_levels(input_nodes), codes)[0]
+        return self.nodes_collection.trace_scenario(
+            {name: float(value) for name, value in zip(inputs, values)}
+        )
+
+    def get_kpi_tensor(self, kpi: str, fixed: Optional[dict] = None) -> np.ndarray:
+        """
+        Get the simulated values of a KPI as a tensor with one axis per ranged input.
+
+        Parameters
+        ----------
+        kpi : str
+            Name of the KPI node.
+        fixed : Optional[dict], optional
+            Dictionary with input node names as keys and level codes (0, 1 or 2, see values_map)
+            as values, by default None. The axes of these inputs are sliced at the given level,
+            which gives the conditional values of the KPI without copying. Inputs that are not
+            ranged have the same value on every level and are ignored.
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (3,) * n, indexed by the level code of each of the n ranged inputs
+            (ranged_input_names, without the fixed ones), in order.
+
+        Raises
+        ------
+        ValueError
+            If the funnel has not been simulated, or a key of `fixed` is not an input node.
+        """
+        if kpi not in self.kpi_tensors:
+            raise ValueError(f"No simulation result for KPI '{kpi}'.")
+        fixed = fixed or {}
+        for name in fixed:
+            if name not in self.input_node_names:
+                raise ValueError(f"'{name}' is not an input node of the funnel.")
+        index = tuple(fixed.get(name, slice(None)) for name in self.ranged_input_names)
+        return self.kpi_tensors[kpi][index]
+
+    def expected_value(self, kpi: str, fixed: Optional[dict] = None) -> float:
+        """
+        Calculate the expected value of a KPI over the simulated scenarios.
+
+        Parameters
+        ----------
+        kpi : str
+            Name of the KPI node.
+        fixed : Optional[dict], optional
+            Level codes of the inputs to condition on, by default None. See get_kpi_tensor.
+
+        Returns
+        -------
+        float
+            Probability weighted mean of the KPI.
+        """
+        return float(expected_over_levels(self.get_kpi_tensor(kpi, fixed)))
+
+    def marginal_expected_values(self, kpi: str, input: str) -> pd.Series:
+        """
+        Calculate the expected value of a KPI with an input at each of its levels.
+
+        Parameters
+        ----------
+        kpi : str
+            Name of the KPI node.
+        input : str
+            Name of the input node.
+
+        Returns
+        -------
+        pd.Series
+            Expected value of the KPI by level label, all other inputs varying.
+        """
+        labels = [details["label"] for details in values_map.values()]
+        if input not in self.ranged_input_names:
+            return pd.Series(self.expected_value(kpi), index=labels)
+        tensor = self.get_kpi_tensor(kpi)
+        keep = self.ranged_input_names.index(input)
+        return pd.Series(expected_over_levels(tensor, keep=keep), index=labels)
+
+    def conditional(self, kpi: str, fixed: dict) -> "Funnel":
+        """
+        Get the simulation results of a KPI with some inputs locked at a level.
+
+        The results are sliced from the current simulation and the scenario weights are
+        renormalised, so nothing is re-evaluated. The returned funnel holds the conditional
+        sim_result, kpi_tensors and input_swing_df, so its get_tornado_chart, get_metalog,
+        get_cdf_chart etc. describe the conditional distribution of the KPI. Locked inputs have
+        zero swing.
+
+        Parameters
+        ----------
+        kpi : str
+            Name of the KPI node.
+        fixed : dict
+            Dictionary with input node names as keys and level codes (0, 1 or 2, see values_map)
+            as values.
+
+        Returns
+        -------
+        Funnel
+            Funnel holding the conditional results of the KPI.
+
+        Raises
+        ------
+        ValueError
+            If the funnel has not been simulated, a key of `fixed` is not an input node, or a
+            value is not a level code.
+        """
+        for name, code in fixed.items():
+            if code not in values_map:
+                raise ValueError(
+                    f"Invalid level code {code} for input '{name}', expected one of "
+                    f"{list(values_map)}."
+                )
+        tensor = self.get_kpi_tensor(kpi, fixed)
+
+        # Rows of the remaining scenarios, in factorial order of the remaining inputs
+        shape = (len(values_map),) * len(self.ranged_input_names)
+        index = tuple(fixed.get(name, slice(None)) for name in self.ranged_input_names)
+        rows = np.arange(len(self.results)).reshape(shape)[index].ravel()
+
+        result = Funnel(self.nodes_collection)
+        result.kpi_node_names = [kpi]
+        result.ranged_input_names = [
+            name for name in self.ranged_input_names if name not in fixed
+        ]
+        result.kpi_tensors = {kpi: tensor}
+        result._set_results(
+            self.results.take(
+                rows,
+                {
+                    name: code
+                    for name, code in fixed.items()
+                    if name in self.ranged_input_names
+                },
+                [kpi],
+            )
+        )
+        result.calculate_inputs_swing()
+        return result
 
     def calculate_inputs_swing(self) -> pd.DataFrame:
         """
@@ -119,21 +365,828 @@ class Funnel:
             Dataframe containing the summary table of each input's swing, swing squared,
             variance percentage of total, and combined uncertainty.
             Dataframe is stored as instance property.
+
+        Raises
+        ------
+        ValueError
+            If there are no factorial simulation results for the KPIs, e.g. after
+            simulate_monte_carlo, simulate_streaming or merge_shards, which calculate their
+            swings themselves.
+        """
+        if (
+            self.results is None
+            or not self.results.is_factorial
+            or any(kpi not in self.kpi_tensors for kpi in self.kpi_node_names)
+        ):
+            raise ValueError(
+                "No factorial simulation results to calculate the swings from, "
+                "run simulate or simulate_to_disk first."
+            )
+        # Scenario code of each input at each level with all other inputs at mid, by
+        # mixed-radix arithmetic. Fixed inputs were not enumerated, they have zero swing.
+        radix = scenario_radix(len(self.ranged_input_names))
+        base = radix.sum()
+        lookup = np.full((len(self.input_node_names), len(values_map)), base)
+        for input, place in zip(self.ranged_input_names, radix):
+            lookup[self.input_node_names.index(input)] += (
+                np.array(list(values_map)) - 1
+            ) * place
+
+        calculations_df = pd.DataFrame(index=self.input_node_names)
+        for kpi in self.kpi_node_names:
+            kpi_values = self.kpi_tensors[kpi].ravel()[lookup].astype(float)
+            for code, details in values_map.items():
+                calculations_df[f"{kpi}_{details['label']}"] = kpi_values[:, code]
+
+        return self._build_swing_df(calculations_df, self._combined_uncertainty())
+
+    def simulate_inputs_swing(self) -> pd.DataFrame:
+        """
+        Calculate each input's swing with a one-at-a-time design, without simulating all combinations.
+
+        Only the base case (all inputs at mid) and the low and high case of each ranged input are
+        evaluated, i.e. 2n+1 scenarios for n ranged inputs instead of 3^n, which keeps tornado
+        charts feasible for models with many inputs. The swings are the same as the ones of
+        calculate_inputs_swing, but the combined uncertainty, which needs every combination,
+        is not calculated.
+
+        Returns
+        -------
+        pd.DataFrame
+            Dataframe containing the summary table of each input's swing, swing squared and
+            variance percentage of total. Dataframe is stored as instance property.
+
+        Raises
+        ------
+        ValueError
+            If no KPI node is found in the funnel.
+        """
+        return self._build_swing_df(self._one_at_a_time_values())
+
+    def simulate_streaming(
+        self, chunk_size: int = 100000, capacity: int = 4096
+    ) -> pd.DataFrame:
+        """
+        Simulate all combinations of the input levels in fixed-size blocks, in bounded memory.
+
+        Scenarios are enumerated in blocks of `chunk_size` in factorial order, and each block is
+        evaluated in batch and fed to running aggregators: a weighted quantile sketch per KPI
+        (kept in self.kpi_sketches, with the mean, standard deviation and histogram) and the
+        cells of the swing table. The full table of scenarios is never held, so peak memory is
+        set by `chunk_size` rather than by 3^n, and sim_result is left empty.
+
+        The swing table is the same as after simulate. The combined uncertainty is exact while
+        there are at most `capacity` scenarios, and approximate otherwise, usually within a few
+        1/capacity of probability, see WeightedQuantileSketch.
+
+        Parameters
+        ----------
+        chunk_size : int, optional
+            Number of scenarios evaluated at once, by default 100000.
+        capacity : int, optional
+            Number of points kept by each quantile sketch, by default 4096.
+
+        Returns
+        -------
+        pd.DataFrame
+            Dataframe containing the summary table of each input's swing, swing squared,
+            variance percentage of total, and combined uncertainty.
+            Dataframe is stored as instance property.
+
+        Raises
+        ------
+        ValueError
+            If no KPI node is found in the funnel.
+        """
+        sketches, cells = self._stream_scenarios(0, 1, chunk_size, capacity)
+        return self._streamed_swing_df(sketches, cells)
+
+    def simulate_to_disk(
+        self,
+        directory: str,
+        chunk_size: int = 100000,
+        kpi_dtype: type = np.float64,
+    ) -> pd.DataFrame:
+        """
+        Simulate all combinations of the input levels into memory-mapped files, for result sets
+        larger than memory.
+
+        Scenarios are enumerated in blocks of `chunk_size` in factorial order, and the level codes
+        and KPIs of each block are written to .npy files in `directory` as soon as it is
+        evaluated (see SimulationResult.create), so memory holds one block at a time. The files
+        are then used in place as self.results: the swing table is read from the KPI tensors,
+        which are views of the files, and the combined uncertainty is computed by scanning them.
+        The results can be reopened later with open_results.
+
+        sim_result materialises the whole result set in memory, so it should be avoided for
+        results larger than memory.
+
+        Parameters
+        ----------
+        directory : str
+            Directory of the files, created if needed. Existing results are overwritten.
+        chunk_size : int, optional
+            Number of scenarios evaluated at once, by default 100000.
+        kpi_dtype : type, optional
+            Type the KPI results are stored as, by default np.float64.
+
+        Returns
+        -------
+        pd.DataFrame
+            Dataframe containing the summary table of each input's swing, swing squared,
+            variance percentage of total, and combined uncertainty.
+            Dataframe is stored as instance property.
+
+        Raises
+        ------
+        ValueError
+            If no KPI node is found in the funnel.
+        """
+        inputs = self.input_node_names
+        kpis = self.kpi_node_names
+        levels, ranged = self._simulation_levels()
+        n_ranged = len(self.ranged_input_names)
+        n_scenarios = len(values_map) ** n_ranged
+
+        results = SimulationResult.create(
+            directory,
+            inputs,
+            levels,
+            kpis,
+            self.ranged_input_names,
+            n_scenarios,
+            kpi_dtype,
+            model=self._model_fingerprint(),
+        )
+        for start, block, batch in self._factorial_blocks(
+            levels, ranged, 0, n_scenarios, chunk_size
+        ):
+            stop = start + len(block)
+            results.codes[start:stop] = block
+            for kpi in kpis:
+                results.kpis[kpi][start:stop] = batch[kpi]
+        results.flush()
+        self.nodes_collection.reset_input_nodes()
+        return self._use_results(results)
+
+    def open_results(self, directory: str) -> pd.DataFrame:
+        """
+        Reopen the results written by simulate_to_disk or simulate_monte_carlo_to_disk, without
+        simulating again.
+
+        The files are memory-mapped rather than read, so reopening takes the same time whatever
+        their size, and the swing table is computed as after the simulation that wrote them.
+
+        Parameters
+        ----------
+        directory : str
+            Directory of the results.
+
+        Returns
+        -------
+        pd.DataFrame
+            Dataframe containing the summary table of each input's swing, swing squared,
+            variance percentage of total, and combined uncertainty.
+            Dataframe is stored as instance property.
+
+        Raises
+        ------
+        ValueError
+            If the results are not from a simulation of this model.
+        """
+        results = SimulationResult.open(directory)
+        if results.model != self._model_fingerprint():
+            raise ValueError(f"Results in '{directory}' are from a different model.")
+        if not results.is_factorial:
+            return self._use_samples(results)
+        self.ranged_input_names = results.code_inputs
+        return self._use_results(results)
+
+    def save_results(self, path: str) -> None:
+        """
+        Save the model, the simulation results and the swing table, to reload them without
+        simulating again (see load_results), e.g. to redraw charts in reports.
+
+        `path` is a directory holding model.json (the JSON of the nodes collection),
+        results.parquet (self.results, see SimulationResult.to_parquet) and
+        input_swing.parquet (self.input_swing_df), the latter two only if they exist.
+        Requires pyarrow.
+
+        Parameters
+        ----------
+        path : str
+            Directory of the files, created if needed.
+        """
+        _import_pyarrow()
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "model.json"), "w") as file:
+            file.write(self.nodes_collection.to_json_str())
+        if self.results is not None:
+            self.results.to_parquet(os.path.join(path, "results.parquet"))
+        if getattr(self, "input_swing_df", None) is not None:
+            self.input_swing_df.to_parquet(os.path.join(path, "input_swing.parquet"))
+
+    @classmethod
+    def load_results(cls, path: str) -> "Funnel":
+        """
+        Load a funnel saved by save_results, with its results and swing table.
+
+        Nothing is evaluated: the model is rebuilt from its JSON, sim_result is materialised
+        from the saved results on first access, and charts are drawn from the saved swing
+        table. The KPIs of the funnel are those of the saved results. Requires pyarrow.
+
+        Parameters
+        ----------
+        path : str
+            Directory written by save_results.
+
+        Returns
+        -------
+        Funnel
+            Funnel over the saved model, holding the saved results.
+        """
+        _import_pyarrow()
+        nodes_collection = NodesCollection()
+        with open(os.path.join(path, "model.json")) as file:
+            nodes_collection.from_json_str(file.read())
+        funnel = cls(nodes_collection)
+
+        results_path = os.path.join(path, "results.parquet")
+        if os.path.exists(results_path):
+            results = SimulationResult.read_parquet(results_path)
+            funnel._set_results(results)
+            # The results may cover fewer KPIs than the model, e.g. those of conditional
+            funnel.kpi_node_names = results.kpi_names
+            if results.is_factorial:
+                funnel.ranged_input_names = results.code_inputs
+                funnel.kpi_tensors = {
+                    kpi: results.tensor(kpi) for kpi in results.kpi_names
+                }
+        swing_path = os.path.join(path, "input_swing.parquet")
+        if os.path.exists(swing_path):
+            funnel.input_swing_df = pd.read_parquet(swing_path)
+        return funnel
+
+    def _use_results(self, results: SimulationResult) -> pd.DataFrame:
+        """Make factorial results stored on disk the current results, and compute the swings."""
+        self._set_results(results)
+        self.kpi_sketches = {}
+        self.kpi_tensors = {kpi: results.tensor(kpi) for kpi in self.kpi_node_names}
+        return self.calculate_inputs_swing()
+
+    def simulate_shard(
+        self,
+        shard: int,
+        n_shards: int,
+        path: str,
+        chunk_size: int = 100000,
+        capacity: int = 4096,
+    ) -> str:
+        """
+        Simulate one shard of the factorial grid and save its partial results to a file.
+
+        The scenario index range is split into `n_shards` contiguous ranges, and shard k
+        streams the k-th one like simulate_streaming. Its quantile sketches (with moments) and
+        swing cells are saved to a compressed .npz file, a few hundred KB at most whatever the
+        size of the model. Shards can run on different machines or processes, and
+        merge_shards combines their files into the results of a single run.
+
+        Parameters
+        ----------
+        shard : int
+            Index of the shard, from 0 to n_shards - 1.
+        n_shards : int
+            Total number of shards.
+        path : str
+            Path of the partial result file to write.
+        chunk_size : int, optional
+            Number of scenarios evaluated at once, by default 100000.
+        capacity : int, optional
+            Number of points kept by each quantile sketch, by default 4096.
+
+        Returns
+        -------
+        str
+            The path of the file.
+
+        Raises
+        ------
+        ValueError
+            If no KPI node is found in the funnel, or the shard index is out of range.
+        """
+        if not 0 <= shard < n_shards:
+            raise ValueError(f"Shard {shard} out of range for {n_shards} shards.")
+
+        sketches, cells = self._stream_scenarios(shard, n_shards, chunk_size, capacity)
+        metadata = {
+            "model": self._model_fingerprint(),
+            "shard": shard,
+            "n_shards": n_shards,
+            "capacity": capacity,
+            "kpi_node_names": self.kpi_node_names,
+            "ranged_input_names": self.ranged_input_names,
+        }
+        arrays = {"metadata": np.array(json.dumps(metadata))}
+        for i, kpi in enumerate(self.kpi_node_names):
+            for key, array in sketches[kpi].get_state().items():
+                arrays[f"sketch_{i}_{key}"] = array
+            arrays[f"cells_{i}"] = cells[kpi].cells
+            arrays[f"base_{i}"] = np.array(cells[kpi].base)
+        with open(path, "wb") as file:
+            np.savez_compressed(file, **arrays)
+        return path
+
+    def merge_shards(self, paths: list) -> pd.DataFrame:
+        """
+        Combine the partial results of all shards of a simulation, see simulate_shard.
+
+        Parameters
+        ----------
+        paths : list
+            Paths of the partial result files of every shard, in any order.
+
+        Returns
+        -------
+        pd.DataFrame
+            Dataframe containing the summary table of each input's swing, swing squared,
+            variance percentage of total, and combined uncertainty, as after
+            simulate_streaming. The swings are identical, the combined uncertainty is within
+            the error of the quantile sketches (exact up to `capacity` scenarios in total).
+            Dataframe is stored as instance property.
+
+        Raises
+        ------
+        ValueError
+            If the files are not the complete set of shards of a simulation of this funnel's model,
+            or a KPI of the funnel was not simulated by the shards.
+        """
+        partials = []
+        for path in paths:
+            with np.load(path) as data:
+                partials.append(
+                    (
+                        json.loads(str(data["metadata"])),
+                        {k: data[k] for k in data.files},
+                    )
+                )
+        if not partials:
+            raise ValueError("No shard to merge.")
+        fingerprint = self._model_fingerprint()
+        n_shards = partials[0][0]["n_shards"]
+        for metadata, _ in partials:
+            if metadata["model"] != fingerprint:
+                raise ValueError("Shard was simulated with a different model.")
+            if metadata["n_shards"] != n_shards:
+                raise ValueError("Shards come from simulations with different splits.")
+        shards = sorted(metadata["shard"] for metadata, _ in partials)
+        if shards != list(range(n_shards)):
+            raise ValueError(f"Expected shards 0 to {n_shards - 1}, got {shards}.")
+        for metadata, _ in partials:
+            missing = set(self.kpi_node_names) - set(metadata["kpi_node_names"])
+            if missing:
+                raise ValueError(
+                    f"KPIs {sorted(missing)} were not simulated by the shards."
+                )
+
+        metadata = partials[0][0]
+        self.ranged_input_names = metadata["ranged_input_names"]
+        sketches = {}
+        cells = {}
+        for kpi in self.kpi_node_names:
+            for shard_metadata, arrays in partials:
+                # Arrays are numbered by the position of the KPI in the shard's own list
+                i = shard_metadata["kpi_node_names"].index(kpi)
+                sketch = WeightedQuantileSketch.from_state(
+                    {
+                        key: arrays[f"sketch_{i}_{key}"]
+                        for key in ("values", "weights", "totals")
+                    },
+                    metadata["capacity"],
+                )
+                shard_cells = SwingCells(len(self.ranged_input_names), len(values_map))
+                shard_cells.cells = arrays[f"cells_{i}"]
+                shard_cells.base = float(arrays[f"base_{i}"])
+                if kpi in sketches:
+                    sketches[kpi].merge(sketch)
+                    cells[kpi].merge(shard_cells)
+                else:
+                    sketches[kpi] = sketch
+                    cells[kpi] = shard_cells
+        return self._streamed_swing_df(sketches, cells)
+
+    def _model_fingerprint(self) -> str:
+        """
+        Hash of what the simulations depend on: the definitions of the calculated nodes and the
+        level values of the inputs, i.e. their low/mid/high ranges, or their value if they are
+        not ranged. The current values of ranged inputs, which simulations reset, are ignored.
+        """
+        inputs = self.input_node_names
+        levels = input_levels([self.nodes_collection.get_node(i) for i in inputs])
+        model = {
+            "definitions": {
+                node.name: node.definition
+                for node in self.nodes_collection.get_calculated_nodes()
+            },
+            "levels": dict(zip(inputs, levels.tolist())),
+        }
+        return hashlib.sha256(json.dumps(model).encode()).hexdigest()
+
+    def _stream_scenarios(
+        self, shard: int, n_shards: int, chunk_size: int, capacity: int
+    ) -> tuple:
+        """
+        Evaluate a shard of the factorial grid in blocks, feeding running aggregators.
+
+        Returns
+        -------
+        tuple
+            Dictionaries with KPI names as keys, and WeightedQuantileSketch and SwingCells as
+            values respectively.
+        """
+        kpis = self.kpi_node_names
+        levels, ranged = self._simulation_levels()
+        n_ranged = len(self.ranged_input_names)
+
+        sketches = {kpi: WeightedQuantileSketch(capacity) for kpi in kpis}
+        cells = {kpi: SwingCells(n_ranged, len(values_map)) for kpi in kpis}
+        n_scenarios = len(values_map) ** n_ranged
+        first = shard * n_scenarios // n_shards
+        last = (shard + 1) * n_scenarios // n_shards
+        for _, block, batch in self._factorial_blocks(
+            levels, ranged, first, last, chunk_size
+        ):
+            weights = scenario_weights(block)
+            for kpi in kpis:
+                sketches[kpi].add(batch[kpi], weights)
+                cells[kpi].add(block, batch[kpi])
+        return sketches, cells
+
+    def _factorial_blocks(
+        self,
+        levels: np.ndarray,
+        ranged: np.ndarray,
+        first: int,
+        last: int,
+        chunk_size: int,
+    ):
+        """
+        Evaluate a range of the factorial grid of the ranged inputs in blocks.
+
+        Parameters
+        ----------
+        levels : np.ndarray
+            Array of shape (n_inputs, 3) of the value of each input at each level.
+        ranged : np.ndarray
+            Boolean array of shape (n_inputs,) of the ranged inputs.
+        first : int
+            Index of the first scenario.
+        last : int
+            Index after the last scenario.
+        chunk_size : int
+            Number of scenarios per block.
+
+        Yields
+        ------
+        tuple
+            Index of the first scenario of the block, array of shape (n_block, n_ranged) of its
+            level codes, and dictionary with KPI names as keys and arrays of shape (n_block,)
+            of their values as values.
+        """
+        n_ranged = int(ranged.sum())
+        for start in range(first, last, chunk_size):
+            block = factorial_codes(n_ranged, start, min(start + chunk_size, last))
+            yield start, block, self._evaluate_codes(levels, ranged, block)
+
+    def _evaluate_codes(
+        self, levels: np.ndarray, ranged: np.ndarray, codes: np.ndarray
+    ) -> dict:
+        """
+        Evaluate the KPIs in scenarios given by the level codes of the ranged inputs.
+
+        Returns
+        -------
+        dict[str, np.ndarray]
+            Dictionary with KPI names as keys and arrays of shape (n_scenarios,) of their values
+            as values.
+        """
+        batch = self.nodes_collection.evaluate_batch(
+            {
+                **self._ranged_values(levels, ranged, codes),
+                **self._fixed_values(levels, ranged),
+            },
+            outputs=self.kpi_node_names,
+        )
+        # KPIs that only depend on fixed inputs are evaluated once, as scalars
+        return {
+            kpi: np.broadcast_to(batch[kpi], len(codes)) for kpi in self.kpi_node_names
+        }
+
+    def _streamed_swing_df(self, sketches: dict, cells: dict) -> pd.DataFrame:
+        """Build the swing table from the aggregators of _stream_scenarios."""
+        inputs = self.input_node_names
+        kpis = self.kpi_node_names
+        ranged = np.array([name in self.ranged_input_names for name in inputs], bool)
+        self.kpi_sketches = sketches
+        self.kpi_tensors = {}
+        self._set_results(None)
+        calculations_df = pd.DataFrame(index=inputs)
+        for kpi in kpis:
+            # Fixed inputs stay on the base case
+            table = np.full((len(inputs), len(values_map)), cells[kpi].base)
+            table[ranged] = cells[kpi].table()
+            for code, details in values_map.items():
+                calculations_df[f"{kpi}_{details['label']}"] = table[:, code]
+        combined = {kpi: sketches[kpi].quantile([0.1, 0.5, 0.9]) for kpi in kpis}
+        return self._build_swing_df(calculations_df, combined)
+
+    def simulate_monte_carlo(
+        self,
+        n_samples: int = 10000,
+        seed: Optional[int] = None,
+        sampler: str = "random",
+    ) -> pd.DataFrame:
+        """
+        Simulate the funnel by sampling the inputs from continuous distributions.
+
+        Each ranged input's low/mid/high values are fitted to a metalog distribution at the
+        quantiles they represent (see values_map), which is sampled by mapping uniform draws
+        through its quantile function. All KPIs are evaluated for all samples in one batch, so
+        the cost scales with the number of samples rather than with 3^n.
+
+        The samples are stored in self.sim_result with equal weights, and self.input_swing_df
+        holds the one-at-a-time swings of simulate_inputs_swing together with the combined
+        uncertainty of the samples, so the tornado, metalog, CDF and cumulative charts work
+        as after simulate. The factorial kpi_tensors are cleared.
+
+        Parameters
+        ----------
+        n_samples : int, optional
+            Number of samples to draw, by default 10000.
+        seed : Optional[int], optional
+            Seed of the random number generator, by default None.
+        sampler : str, optional
+            Sampling design of the uniform draws, by default "random". "sobol" (scrambled) and
+            "latin_hypercube" spread the samples more evenly and need far fewer of them for the
+            same quantile precision, see simulation.sample_uniforms.
+
+        Returns
+        -------
+        pd.DataFrame
+            Result dataframe with the value of every input and every KPI in each sample, with
+            the same columns as the one of simulate_input_variance. Inputs that are not ranged
+            stay on their mid value, and the level labels of sampled inputs are missing.
+
+        Raises
+        ------
+        ValueError
+            If no KPI node is found in the funnel, or the sampler is unknown.
+        """
+        levels, ranged = self._simulation_levels()
+        uniforms = sample_uniforms(
+            n_samples, len(self.ranged_input_names), sampler, seed
+        )
+        samples = self._sampled_values(levels, ranged, uniforms)
+        batch = self.nodes_collection.evaluate_batch(
+            {**samples, **self._fixed_values(levels, ranged)},
+            outputs=self.kpi_node_names,
+        )
+
+        self._use_samples(
+            SimulationResult(
+                self.input_node_names,
+                levels,
+                {
+                    kpi: np.broadcast_to(batch[kpi], n_samples).astype(float)
+                    for kpi in self.kpi_node_names
+                },
+                samples=samples,
+            )
+        )
+        return self.sim_result
+
+    def simulate_monte_carlo_to_disk(
+        self,
+        directory: str,
+        n_samples: int = 10000,
+        seed: Optional[int] = None,
+        sampler: str = "random",
+        chunk_size: int = 100000,
+        kpi_dtype: type = np.float64,
+    ) -> pd.DataFrame:
+        """
+        Simulate the funnel by sampling the inputs into memory-mapped files, for sample sets
+        larger than memory.
+
+        The samples are those of simulate_monte_carlo with the same arguments, drawn and
+        evaluated in blocks of `chunk_size`, and the input values and KPIs of each block are
+        written to .npy files in `directory` as soon as it is evaluated, as in
+        simulate_to_disk. The files are then used in place as self.results, and the combined
+        uncertainty is computed by scanning them. The results can be reopened later with
+        open_results.
+
+        Parameters
+        ----------
+        directory : str
+            Directory of the files, created if needed. Existing results are overwritten.
+        n_samples : int, optional
+            Number of samples to draw, by default 10000.
+        seed : Optional[int], optional
+            Seed of the random number generator, by default None.
+        sampler : str, optional
+            "random" or "sobol", by default "random". Latin hypercube designs cannot be
+            drawn in blocks, see simulation.sample_uniform_blocks.
+        chunk_size : int, optional
+            Number of samples evaluated at once, by default 100000.
+        kpi_dtype : type, optional
+            Type the KPI results are stored as, by default np.float64.
+
+        Returns
+        -------
+        pd.DataFrame
+            Dataframe containing the summary table of each input's one-at-a-time swing, swing
+            squared, variance percentage of total, and the combined uncertainty of the samples.
+            Dataframe is stored as instance property.
+
+        Raises
+        ------
+        ValueError
+            If no KPI node is found in the funnel, or the sampler is unknown or cannot be
+            drawn in blocks.
         """
-        labels_list = [details["label"] for details in values_map.values()]
-        df = self.sim_result
-        kpi_cols = [f"{i}_{j}" for i in self.kpi_node_names for j in labels_list]
-        calculations_df = pd.DataFrame(index=self.input_node_names, columns=kpi_cols)
+        kpis = self.kpi_node_names
+        levels, ranged = self._simulation_levels()
+        blocks = sample_uniform_blocks(
+            n_samples, len(self.ranged_input_names), sampler, seed, chunk_size
+        )
+        constants = self._fixed_values(levels, ranged)
+
+        results = SimulationResult.create(
+            directory,
+            self.input_node_names,
+            levels,
+            kpis,
+            [],
+            n_samples,
+            kpi_dtype,
+            model=self._model_fingerprint(),
+            sampled_inputs=self.ranged_input_names,
+        )
+        for start, uniforms in blocks:
+            stop = start + len(uniforms)
+            samples = self._sampled_values(levels, ranged, uniforms)
+            batch = self.nodes_collection.evaluate_batch(
+                {**samples, **constants}, outputs=kpis
+            )
+            for name, values in samples.items():
+                results.samples[name][start:stop] = values
+            for kpi in kpis:
+                results.kpis[kpi][start:stop] = batch[kpi]
+        results.flush()
+        return self._use_samples(results)
+
+    def _sampled_values(
+        self, levels: np.ndarray, ranged: np.ndarray, uniforms: np.ndarray
+    ) -> dict:
+        """
+        Map uniform draws to the values of the ranged inputs, through the metalog distribution
+        fitted to each input's low/mid/high values at the quantiles they represent.
+        """
+        cdf_ps = [details["represented_qtile"] for details in values_map.values()]
+        return {
+            self.input_node_names[i]: metalog_quantile(
+                MetaLogistic(cdf_xs=levels[i].tolist(), cdf_ps=cdf_ps), uniforms[:, j]
+            )
+            for j, i in enumerate(np.flatnonzero(ranged))
+        }
+
+    def _use_samples(self, results: SimulationResult) -> pd.DataFrame:
+        """Make sampled results the current results, and compute the swings."""
+        self._set_results(results)
+        self.kpi_sketches = {}
+        self.kpi_tensors = {}
+        return self._build_swing_df(
+            self._one_at_a_time_values(), self._combined_uncertainty()
+        )
+
+    def _one_at_a_time_values(self) -> pd.DataFrame:
+        """
+        Evaluate the KPIs with each input at its low/mid/high level and all others at mid.
+
+        Returns
+        -------
+        pd.DataFrame
+            Dataframe with input node names as index and {kpi}_value_low/mid/high columns.
+        """
+        inputs = self.input_node_names
+        levels, ranged = self._simulation_levels()
+        n_ranged = len(self.ranged_input_names)
+        batch = self._evaluate_codes(levels, ranged, one_at_a_time_codes(n_ranged))
+
+        # Row of the low and high scenario of each input, fixed inputs stay on the base case
+        low_rows = np.zeros(len(inputs), dtype=int)
+        low_rows[ranged] = np.arange(1, 2 * n_ranged, 2)
+        high_rows = np.zeros(len(inputs), dtype=int)
+        high_rows[ranged] = np.arange(2, 2 * n_ranged + 1, 2)
+        calculations_df = pd.DataFrame(index=inputs)
         for kpi in self.kpi_node_names:
-            for input in self.input_node_names:
-                for i in labels_list:
-                    other_cols = [x for x in self.input_node_names if x != input]
-                    lookup = df[
-                        (df[input] == i) & ((df[other_cols] == "value_mid").all(axis=1))
-                    ]
-                    calculations_df.loc[input, f"{kpi}_{i}"] = lookup[kpi].values[0]
-
-        # calculate swings
+            result = batch[kpi]
+            calculations_df[f"{kpi}_value_low"] = result[low_rows]
+            calculations_df[f"{kpi}_value_mid"] = result[0]
+            calculations_df[f"{kpi}_value_high"] = result[high_rows]
+        return calculations_df
+
+    def _simulation_levels(self) -> tuple:
+        """
+        Get the levels of the inputs to simulate, and set ranged_input_names.
+
+        Only inputs whose value changes across levels are enumerated or sampled; the others
+        would multiply the number of scenarios while giving identical ones, and are held at
+        their mid value.
+
+        Returns
+        -------
+        tuple
+            Array of shape (n_inputs, 3) of the value of each input at each level (see
+            input_levels), and boolean array of shape (n_inputs,) of the ranged inputs.
+
+        Raises
+        ------
+        ValueError
+            If no KPI node is found in the funnel.
+        """
+        # Make sure that the nodes_collection has at least 1 calculated node tagged is_kpi=True
+        if not any(node.is_kpi for node in self.nodes_collection):
+            raise ValueError("No KPI node found in the funnel.")
+        inputs = self.input_node_names
+        levels = input_levels([self.nodes_collection.get_node(i) for i in inputs])
+        ranged = ranged_inputs(levels)
+        self.ranged_input_names = [name for i, name in enumerate(inputs) if ranged[i]]
+        return levels, ranged
+
+    def _ranged_values(
+        self, levels: np.ndarray, ranged: np.ndarray, codes: np.ndarray
+    ) -> dict:
+        """
+        Get the values of the ranged inputs in scenarios given by level codes.
+
+        Parameters
+        ----------
+        levels : np.ndarray
+            Array of shape (n_inputs, 3) of the value of each input at each level.
+        ranged : np.ndarray
+            Boolean array of shape (n_inputs,) of the ranged inputs.
+        codes : np.ndarray
+            Array of shape (n_scenarios, n_ranged) of the level codes of the ranged inputs.
+
+        Returns
+        -------
+        dict[str, np.ndarray]
+            Dictionary with the ranged input names as keys and arrays of values as values.
+        """
+        return {
+            self.input_node_names[i]: levels[i][codes[:, j]]
+            for j, i in enumerate(np.flatnonzero(ranged))
+        }
+
+    def _fixed_values(self, levels: np.ndarray, ranged: np.ndarray) -> dict:
+        """
+        Get the mid value of the inputs that are not ranged.
+
+        They are passed to evaluate_batch as scalars, so that the parts of the graph they feed
+        are folded and evaluated once instead of per scenario.
+        """
+        return {
+            name: levels[i, 1]
+            for i, name in enumerate(self.input_node_names)
+            if not ranged[i]
+        }
+
+    def _combined_uncertainty(self) -> dict:
+        """Get the 10th, 50th and 90th weighted percentiles of each KPI in the results."""
+        return {
+            kpi: self.results.quantiles(kpi, [0.1, 0.5, 0.9])
+            for kpi in self.kpi_node_names
+        }
+
+    def _build_swing_df(
+        self, calculations_df: pd.DataFrame, combined: Optional[dict] = None
+    ) -> pd.DataFrame:
+        """
+        Add the swing columns to a table of KPI values with each input at its low/mid/high level.
+
+        Parameters
+        ----------
+        calculations_df : pd.DataFrame
+            Dataframe with input node names as index and {kpi}_value_low/mid/high columns.
+        combined : Optional[dict], optional
+            Dictionary with KPI names as keys and their 10th, 50th and 90th percentile over
+            all scenarios as values, by default None leaves out the combined uncertainty.
+
+        Returns
+        -------
+        pd.DataFrame
+            The completed dataframe, also stored as instance property input_swing_df.
+        """
         for kpi in self.kpi_node_names:
             # max - min for all columns with column name starts with kpi_
             kpi_cols = [x for x in calculations_df.columns if x.startswith(f"{kpi}_")]
@@ -144,15 +1197,11 @@ class Funnel:
             calculations_df[f"{kpi}_swing_squared"] = calculations_df[
                 f"{kpi}_swing"
             ].apply(lambda x: x**2)
-            calculations_df.loc["Combined Uncertainty", f"{kpi}_low"] = np.quantile(
-                df[kpi], 0.1, weights=df["weights"], method="inverted_cdf"
-            )
-            calculations_df.loc["Combined Uncertainty", f"{kpi}_mid"] = np.quantile(
-                df[kpi], 0.5, weights=df["weights"], method="inverted_cdf"
-            )
-            calculations_df.loc["Combined Uncertainty", f"{kpi}_high"] = np.quantile(
-                df[kpi], 0.9, weights=df["weights"], method="inverted_cdf"
-            )
+            if combined is not None:
+                for label, value in zip(("low", "mid", "high"), combined[kpi]):
+                    calculations_df.loc["Combined Uncertainty", f"{kpi}_{label}"] = (
+                        value
+                    )
             calculations_df[f"% of Variance ({kpi})"] = (
                 calculations_df[f"{kpi}_swing_squared"]
                 / calculations_df[f"{kpi}_swing_squared"].sum()
@@ -164,9 +1213,19 @@ class Funnel:
         return calculations_df
 
     def get_tornado_chart(self, kpi: str):
-        df = self.input_swing_df.sort_values(
-            by=f"{kpi}_swing_squared", na_position="first"
+        # One bar per input, from the KPI values with the input at its low/mid/high level
+        swing_df = self.input_swing_df.drop(
+            index="Combined Uncertainty", errors="ignore"
         )
+        df = pd.DataFrame(
+            {
+                **{
+                    f"{kpi}_{level}": swing_df[f"{kpi}_value_{level}"]
+                    for level in ("low", "mid", "high")
+                },
+                f"{kpi}_swing_squared": swing_df[f"{kpi}_swing_squared"],
+            }
+        ).sort_values(by=f"{kpi}_swing_squared", na_position="first")
         return plot_tornado(df=df, kpi=kpi)
 
     def get_metalog(self, kpi: str):
@@ -253,4 +1312,11 @@ class Funnel:
         return float(pr)
 
     def get_cumulative_chart(self, kpi: str):
-        return generate_cumulative_distribution_chart(self.sim_result, kpi=kpi)
+        data = self.sim_result
+        if kpi not in data:
+            # Streamed simulations keep no scenarios, only a quantile sketch of each KPI
+            if kpi not in self.kpi_sketches:
+                raise ValueError(f"No simulation results for KPI '{kpi}'.")
+            values, weights = self.kpi_sketches[kpi].points()
+            data = pd.DataFrame({kpi: values, "weights": weights})
+        return generate_cumulative_distribution_chart(data, kpi=kpi)
@@ -1,10 +1,51 @@
 import logging
 from typing import Optional
 
+from decision_analytics.node_store import (
+    NodeStore,
+    float_field,
+    flag_field,
+    rank_field,
+    text_field,
+)
 from decision_analytics.utils import format_float
 
 
 class Node:
+    """
+    A node of a decision funnel.
+
+    Nodes are lightweight views over a row of a NodeStore: all attributes are stored in the
+    store's columns. Nodes created by a NodesCollection share the collection's store, while
+    standalone nodes get a store of their own. Reading an attribute goes through the store, so
+    loops over many nodes are better served by NodesCollection.get_values.
+    """
+
+    __slots__ = ("_store", "_idx", "_collection")
+
+    name = text_field("name")
+    format_str = text_field("format_str", intern=True)
+    description = text_field("description")
+    value = float_field("value")
+    value_low = float_field("value_low")
+    value_mid = float_field("value_mid")
+    value_high = float_field("value_high")
+    is_kpi = flag_field("is_kpi")
+    readable_large_number = flag_field("readable_large_number")
+    rank = rank_field()
+
+    @property
+    def long_name(self) -> str:
+        """A longer, more descriptive name for the node, derived from the name if not provided."""
+        long_name = self._store.long_name[self._idx]
+        if long_name is None:
+            return self.name.replace("_", " ").title()
+        return long_name
+
+    @long_name.setter
+    def long_name(self, long_name: Optional[str]):
+        self._store.long_name[self._idx] = None if long_name == "" else long_name
+
     def __init__(
         self,
         name: str,
@@ -18,6 +59,7 @@ class Node:
         value: Optional[float] = None,
         is_kpi: Optional[bool] = False,
         readable_large_number: bool = True,
+        store: Optional[NodeStore] = None,
         **kwargs,
     ):
         """Initializes a node object
@@ -46,6 +88,8 @@ class Node:
             The initial value of the node, by default None.
         readable_large_number : bool, optional
             Whether to format large numbers in a more readable way, by default True.
+        store : Optional[NodeStore], optional
+            The store holding the node's attributes, by default None creates a new store.
 
         Raises
         ------
@@ -61,19 +105,34 @@ class Node:
             raise ValueError("Value must be provided when node_type is 'input'")
         if node_type not in ["input", "calculation"]:
             raise ValueError("node_type must be either 'input' or 'calculation'")
+        if is_kpi and node_type == "input":
+            raise ValueError("KPIs cannot be input node.")
+        if any([value_low, value_mid, value_high]) and not all(
+            [value_low, value_mid, value_high]
+        ):
+            raise ValueError(
+                "If any of value_low, value_mid, or value_high are provided, all three must be provided."
+            )
+        if (
+            all([value_low, value_mid, value_high])
+            and not value_low <= value_mid <= value_high
+        ):
+            raise ValueError(
+                "value_low, value_mid, and value_high must be in ascending order."
+            )
+
+        # row of the store holding the node attributes
+        self._store = NodeStore(capacity=1) if store is None else store
+        self._idx = self._store.allocate(self)
+        # collection the node belongs to, notified of value changes
+        self._collection = None
 
         # metadata attributes
         self.name = name
-        self.node_type = node_type
+        self._store.is_input[self._idx] = node_type == "input"
         self.readable_large_number = readable_large_number
-        self.long_name = (
-            name.replace("_", " ").title()
-            if long_name is None or long_name == ""
-            else long_name
-        )
+        self.long_name = long_name
         self.description = description
-        if is_kpi and node_type == "input":
-            raise ValueError("KPIs cannot be input node.")
         self.is_kpi = is_kpi
 
         # value and distribution attributes
@@ -88,22 +147,14 @@ class Node:
         self.value_mid = value_mid
         self.value_high = value_high
 
-        if any([value_low, value_mid, value_high]) and not all(
-            [value_low, value_mid, value_high]
-        ):
-            raise ValueError(
-                "If any of value_low, value_mid, or value_high are provided, all three must be provided."
-            )
-        if (
-            all([value_low, value_mid, value_high])
-            and not value_low <= value_mid <= value_high
-        ):
-            raise ValueError(
-                "value_low, value_mid, and value_high must be in ascending order."
-            )
         # rank, for sorting nodes
         self.rank = 0
 
+    @property
+    def node_type(self) -> str:
+        """The type of the node, either "input" or "calculation"."""
+        return "input" if self._store.is_input[self._idx] else "calculation"
+
     def _pretty_value(self) -> str:
         """
         Pretty printing the value of the node, applying string formatting to the numeric value
@@ -142,4 +193,6 @@ class Node:
         if self.node_type == "input" and new_value is None:
             raise ValueError("Value must be provided when node_type is 'input'")
         self.value = new_value
-        logging.debug(f"Updated value of node {self.name} to: {new_value}")
+        logging.debug("Updated value of node %s to: %s", self.name, new_value)
+        if self.node_type == "input" and self._collection is not None:
+            self._collection.mark_changed([self.name])
@@ -1,17 +1,67 @@
+import itertools
 import logging
-import re
 import json
+from typing import Optional
+
+import numpy as np
 
 from decision_analytics import CalculatedNode, Node
+from decision_analytics.dependency_graph import DependencyGraph
+from decision_analytics.evaluation_plan import EvaluationPlan, definition_variables
+from decision_analytics.node_store import NodeStore
+from decision_analytics.tracing import RecordingTracer, Tracer
 
 
 class NodesCollection:
     """
     A funnel is a collection of nodes.
+
+    The attributes of all nodes are held in a single columnar NodeStore, and the node objects
+    are views over its rows. get_values gives vectorized access to an attribute of all nodes.
+
+    Evaluations are reported to the collection's tracer, a no-op Tracer by default. Assign an
+    enabled tracer (such as RecordingTracer) to `tracer` to record refreshes, or use
+    trace_scenario to trace a single scenario.
+
+    Changes to input values made through set_node_values_from_dict or Node.update_value mark
+    the calculated nodes downstream of them as stale. refresh_nodes(incremental=True) then only
+    re-evaluates the stale nodes. In a lazy collection, reading the value of a stale calculated
+    node evaluates it (and its stale ancestors) on demand, without any refresh.
     """
 
-    def __init__(self):
-        self.nodes = {}
+    def __init__(self, lazy: bool = False):
+        """
+        Parameters
+        ----------
+        lazy : bool, optional
+            Whether reading a stale calculated node's value evaluates it on demand, by default False.
+        """
+        self._nodes = {}
+        self._sorted = True
+        self.lazy = lazy
+        self.tracer = Tracer()
+        self._graph = DependencyGraph()
+        self._store = NodeStore()
+        self._plan = None
+        self._ranked = True
+        self._stale = set()
+
+    @property
+    def nodes(self) -> dict:
+        """
+        Dictionary of node name to node, sorted by rank (and in insertion order within a rank).
+
+        Adding nodes that rank before existing ones leaves the dictionary unsorted until it is
+        next read, so that adding many small batches of nodes sorts it once rather than on every
+        batch.
+        """
+        if not self._sorted:
+            names = list(self._nodes)
+            rows = [node._idx for node in self._nodes.values()]
+            order = np.argsort(self._store.rank[rows], kind="stable")
+            self._nodes = {names[i]: self._nodes[names[i]] for i in order}
+            self._sorted = True
+        return self._nodes
 
     def __iter__(self):
         return iter(self.nodes.values())
@@ -73,7 +123,12 @@ class NodesCollection:
                 raise ValueError("JSON must contain a list of node definitions")
 
             # Clear existing nodes
-            self.nodes = {}
+            self._nodes = {}
+            self._sorted = True
+            self._graph = DependencyGraph()
+            self._store = NodeStore()
+            self._ranked = True
+            self._stale = set()
 
             # Add nodes from JSON
             self.add_nodes(nodes_data)
@@ -85,30 +140,94 @@ class NodesCollection:
         """Add nodes
         This method is used for loading nodes from json as well as just manually adding nodes one by one.
 
+        Validation and ranking are incremental: only the definitions of the added nodes are checked,
+        and only the added nodes and the nodes downstream of them are ranked.
+
         Parameters
         ----------
         nodes_list : list
             List of dictionaries each specifying one node. Can be either input or calculated node.
         """
+        added = []
         for node in nodes_list:
-            if node["node_type"] == "input":
-                self.nodes[node["name"]] = Node(**node)
-            elif node["node_type"] == "calculation":
-                self.nodes[node["name"]] = CalculatedNode(**node)
-            else:
+            if node["node_type"] not in ["input", "calculation"]:
                 raise ValueError(
                     f'Node must be either "input" or "calculation". Bad node definition: {node}'
                 )
+            if node["node_type"] == "input":
+                new_node = Node(**node, store=self._store)
+            else:
+                new_node = CalculatedNode(**node, store=self._store)
+            if node["name"] in self._nodes:
+                # Replaced nodes keep their attributes in a store of their own
+                self._store.detach(self._nodes[node["name"]])
+                self._nodes[node["name"]]._collection = None
+            self._nodes[node["name"]] = new_node
+            if node["node_type"] == "input":
+                self._graph.set_node(node["name"], [], is_input=True)
+            else:
+                self._graph.set_node(
+                    node["name"], definition_variables(node["definition"])
+                )
+            new_node._collection = self
+            added.append(node["name"])
 
-        self._check_valid_definitions()
-        self._rank_nodes()
+        self._update_nodes(added)
+
+    def _redefine(self, node_name: str) -> None:
+        """Update the dependency graph after the definition of a calculated node changed."""
+        self._graph.set_node(
+            node_name, definition_variables(self._nodes[node_name].definition)
+        )
+        self._update_nodes([node_name])
+
+    def _update_nodes(self, node_names: list) -> None:
+        """
+        Validate and rank nodes added or redefined, and the nodes downstream of them, and mark
+        them as stale.
+        """
+        self._plan = None
+        # Ranks of other nodes are only known if the collection was ranked before the change
+        was_ranked = self._ranked
+        # Until validated and ranked, the plan must rank (and report) all nodes again
+        self._ranked = False
+        self._check_valid_definitions(node_names)
+        affected = self._graph.downstream(node_names).union(node_names)
+        self._rank_nodes(affected if was_ranked else None)
+        # Changed nodes and everything downstream of them need to be re-evaluated
+        self._stale.update(name for name in affected if name not in self._graph.inputs)
 
     def remove_node(self, node_name: str) -> None:
         """
         Remove a node from the collection.
         """
-        logging.debug(f"Removing node: {node_name}")
-        del self.nodes[node_name]
+        logging.debug("Removing node: %s", node_name)
+        node = self._nodes.pop(node_name)
+        self._store.detach(node)
+        node._collection = None
+        self._graph.remove_node(node_name)
+        self._stale.discard(node_name)
+        self._plan = None
+        # Nodes depending on the removed node can no longer be ranked
+        self._ranked = False
+
+    def get_evaluation_plan(self) -> EvaluationPlan:
+        """
+        Get the compiled evaluation plan of the collection, building it if needed.
+
+        The plan is cached and only rebuilt after nodes are added, removed or redefined through
+        add_nodes, from_json_str, remove_node or CalculatedNode.definition.
+
+        Returns
+        -------
+        EvaluationPlan
+            Plan holding the compiled definitions and evaluation order of the calculated nodes.
+        """
+        if self._plan is None:
+            if not self._ranked:
+                self._rank_nodes()
+            self._plan = EvaluationPlan(self.nodes, self._graph.parents, self._store)
+        return self._plan
 
     def set_node_values_from_dict(self, values_dict: dict, lookup: bool = True) -> None:
         """
@@ -136,6 +255,7 @@ class NodesCollection:
         ValueError
             If the node doesn't have a 'value' attribute (this should be impossible)
         """
+        changed = []
         for node_name, value in values_dict.items():
             try:
                 node = self.get_node(node_name)
@@ -168,6 +288,8 @@ class NodesCollection:
                         v = node.value
                 else:
                     v = value
+                if v != node.value:
+                    changed.append(node_name)
                 node.value = v
             except KeyError:
                 raise ValueError(
@@ -177,6 +299,42 @@ class NodesCollection:
                 raise ValueError(
                     f"Node '{node_name}' does not have a 'value' attribute."
                 )
+        self.mark_changed(changed)
+
+    def mark_changed(self, node_names: list) -> None:
+        """
+        Mark the calculated nodes downstream of changed nodes as stale.
+
+        Parameters
+        ----------
+        node_names : list
+            Names of the nodes whose value or definition changed.
+        """
+        if node_names:
+            self._stale.update(self._graph.downstream(node_names))
+
+    def get_stale_nodes(self) -> list:
+        """Get the calculated nodes whose value is out of date, in evaluation order."""
+        return [
+            self.nodes[name]
+            for name in self.get_evaluation_plan().order
+            if name in self._stale
+        ]
+
+    def _pull(self, node_name: str) -> None:
+        """Evaluate a stale calculated node, after its stale ancestors."""
+        plan = self.get_evaluation_plan()
+        # Stale nodes only have stale descendants, so the stale ancestors are reached through
+        # stale parents only
+        names = {node_name}
+        pending = [node_name]
+        while pending:
+            for parent in self._graph.parents[pending.pop()]:
+                if parent in self._stale and parent not in names:
+                    names.add(parent)
+                    pending.append(parent)
+        self._stale -= names
+        plan.run(names, tracer=self.tracer)
 
     def get_node(self, name: str) -> Node:
         """
@@ -197,11 +355,35 @@ class NodesCollection:
         ValueError
             If user provided a name that doesn't exists in the collection.
         """
-        for node in self.nodes:
-            if node == name:
-                return self.nodes[node]
+        if name in self._nodes:
+            return self._nodes[name]
         raise ValueError(f"Node '{name}' does not exist.")
 
+    def get_values(self, attribute: str = "value") -> np.ndarray:
+        """
+        Get a numeric attribute of all nodes at once, from the node store.
+
+        Parameters
+        ----------
+        attribute : str, optional
+            Name of the attribute, one of "value", "value_low", "value_mid", "value_high",
+            "rank", "is_kpi", by default "value".
+
+        Returns
+        -------
+        np.ndarray
+            Array with the attribute of each node, in the order of the nodes dictionary.
+            Missing values are NaN.
+
+        Raises
+        ------
+        ValueError
+            If the attribute is not a numeric column of the node store.
+        """
+        if attribute not in NodeStore.float_columns + ("rank", "is_kpi"):
+            raise ValueError(f"'{attribute}' is not a numeric node attribute.")
+        return getattr(self._store, attribute)[self.get_evaluation_plan().rows]
+
     def get_input_nodes(self):
         return [
             node for node in self.nodes.values() if not isinstance(node, CalculatedNode)
@@ -215,30 +397,118 @@ class NodesCollection:
     def get_kpi_nodes(self):
         return [node for node in self.nodes.values() if node.is_kpi]
 
+    def get_uncertain_nodes(self) -> list:
+        """
+        Get the nodes whose value depends on the uncertainty of the inputs.
+
+        These are the input nodes with a percentile range (low different from high) and every
+        node depending on them. All other nodes keep the same value in every simulated scenario.
+
+        Returns
+        -------
+        list
+            List of uncertain nodes, in evaluation order.
+        """
+        ranged = [
+            node.name
+            for node in self.get_input_nodes()
+            if all([node.value_low, node.value_mid, node.value_high])
+            and node.value_low != node.value_high
+        ]
+        uncertain = set(ranged) | self._graph.downstream(ranged)
+        return [node for node in self.nodes.values() if node.name in uncertain]
+
     def get_unused_nodes(self) -> list:
         """Get a list of input nodes that are not included in any calculated node definitions"""
-        used_node_names = set()
-        for node in self.nodes.values():
-            if isinstance(node, CalculatedNode):
-                used_node_names.update(re.findall(r"\b\w+\b", node.definition))
         return [
-            node for node in self.get_input_nodes() if node.name not in used_node_names
+            node
+            for node in self.get_input_nodes()
+            if not self._graph.children.get(node.name)
         ]
 
+    def get_parents(self, name: str) -> list:
+        """Get the names of the nodes directly referenced by a node's definition."""
+        self.get_node(name)
+        return list(self._graph.parents[name])
+
+    def get_children(self, name: str) -> list:
+        """Get the names of the calculated nodes whose definition directly references a node."""
+        self.get_node(name)
+        children = self._graph.children.get(name, ())
+        return [child for child in self.nodes if child in children]
+
+    def ancestors(self, name: str) -> list:
+        """
+        Get the names of all nodes a node depends on, directly or indirectly.
+
+        Parameters
+        ----------
+        name : str
+            Name of the node
+
+        Returns
+        -------
+        list
+            Names of the ancestor nodes, in evaluation order.
+        """
+        self.get_node(name)
+        return self._graph.ancestors(name)
+
+    def descendants(self, name: str) -> list:
+        """
+        Get the names of all calculated nodes depending on a node, directly or indirectly.
+
+        Parameters
+        ----------
+        name : str
+            Name of the node
+
+        Returns
+        -------
+        list
+            Names of the descendant nodes, in evaluation order.
+        """
+        self.get_node(name)
+        return self._graph.descendants(name)
+
+    def inputs_affecting(self, kpi: str) -> list:
+        """
+        Get the names of the input nodes a node (usually a KPI) depends on.
+
+        Parameters
+        ----------
+        kpi : str
+            Name of the node
+
+        Returns
+        -------
+        list
+            Names of the input nodes affecting the node.
+        """
+        self.get_node(kpi)
+        return self._graph.inputs_affecting(kpi)
+
     def get_nodes_mapping(self) -> dict:
         """Get a dict where each key is each node's name and value is its corresponding long name"""
         return {node.name: node.long_name for node in self.nodes.values()}
 
-    def _check_valid_definitions(self):
-        """Make sure that the definition of the relationship is valid and is safe."""
+    def _check_valid_definitions(self, node_names=None):
+        """Make sure that the definition of the relationship is valid and is safe.
+
+        Parameters
+        ----------
+        node_names : Optional[list], optional
+            Names of the nodes to check, by default None checks all nodes.
+        """
         allowed_operators = set("+-*/() _0123456789")  # Allowing digits now
-        for node in self.nodes.values():
+        if node_names is None:
+            node_names = list(self._nodes)
+        for name in node_names:
+            node = self._nodes[name]
             if isinstance(node, CalculatedNode):
-                # Extract all variable names from the definition
-                variables = re.findall(r"\b\w+\b", node.definition)
-                for var in variables:
-                    # Accept digit as valid
-                    if var not in self.nodes and not var.isdigit():
+                # Variable names were extracted from the definition by the dependency graph
+                for var in self._graph.parents[node.name]:
+                    if var not in self._nodes:
                         raise ValueError(
                             f"Variable '{var}' in node '{node.name}' is not a valid input node."
                         )
@@ -250,108 +520,188 @@ class NodesCollection:
                             f"Invalid character '{char}' in definition of node '{node.name}'."
                         )
 
-    def _rank_nodes(self):
-        # Get list of all input nodes, no need to rank them.
-        input_nodes = [
-            node for node in self.nodes.values() if not isinstance(node, CalculatedNode)
-        ]
+    def _rank_nodes(self, node_names=None):
+        """
+        Rank the nodes from the cached dependency graph, and sort the nodes dictionary by rank.
 
-        # Get list of all calculated nodes
-        calculated_nodes = [
-            node for node in self.nodes.values() if isinstance(node, CalculatedNode)
-        ]
+        Input nodes get rank 0, and calculated nodes get one more than the highest rank of the
+        nodes in their definition.
 
-        # All input nodes get rank 0
-        for node in input_nodes:
-            node.rank = 0
-
-        # Rank the calculated nodes
-        rank = 1
-        max_iterations = len(calculated_nodes)  # Prevent infinite loops
-        iteration_count = 0
-
-        while calculated_nodes and iteration_count < max_iterations:
-            iteration_count += 1
-            for node in calculated_nodes[:]:
-                variables = re.findall(r"\b\w+\b", node.definition)
-                # Check if all variables are resolved and ranked
-                # Allow constants in the definition
-                if all(
-                    var.isdigit() or (var in self.nodes and self.nodes[var].rank < rank)
-                    for var in variables
-                ):
-                    node.rank = rank
-                    calculated_nodes.remove(node)
-
-            rank += 1
+        Parameters
+        ----------
+        node_names : Optional[set], optional
+            Names of the nodes to rank, which must include everything downstream of them.
+            By default None ranks all nodes.
+
+        Raises
+        ------
+        ValueError
+            If some nodes cannot be ranked because of a dependency cycle or a missing node.
+            The message includes the offending dependency path.
+        """
+        if node_names is None:
+            node_names = set(self._nodes)
+            ranks = self._graph.rank()
+        else:
+            ranks = self._graph.rank(
+                node_names, known_ranks=lambda name: self._nodes[name].rank
+            )
 
         # Check if there are unranked nodes remaining
-        if calculated_nodes:
+        unranked = [self._nodes[name] for name in node_names if name not in ranks]
+        if unranked:
+            self._ranked = False
+            path = self._graph.find_cycle({node.name for node in unranked})
             error_message = (
                 "Unresolvable dependencies detected for the following nodes:\n"
             )
             error_message += "\n".join(
-                f"{node.name} : {node.definition}" for node in calculated_nodes
+                f"{node.name} : {node.definition}" for node in unranked
             )
+            if path[0] == path[-1]:
+                error_message += f"\nDependency cycle: {' -> '.join(path)}"
+            else:
+                error_message += f"\nMissing dependency: {' -> '.join(path)}"
             raise ValueError(error_message)
 
-        # Sorting the nodes dictionary by the rank attribute of the node objects
-        self.nodes = dict(sorted(self.nodes.items(), key=lambda item: item[1].rank))
+        rows = [self._nodes[name]._idx for name in ranks]
+        self._store.rank[rows] = list(ranks.values())
+
+        # When the ranked nodes are the last ones of the dictionary and rank after all others,
+        # sorting them among themselves keeps the dictionary sorted. Otherwise, it is sorted
+        # again on its next read, see nodes.
+        if self._sorted:
+            last_names = list(itertools.islice(reversed(self._nodes), len(ranks) + 1))
+            appended = last_names[: len(ranks)][::-1]
+            max_previous_rank = (
+                self._nodes[last_names[-1]].rank if len(last_names) > len(ranks) else 0
+            )
+            if (
+                set(appended) == ranks.keys()
+                and min(ranks.values(), default=0) >= max_previous_rank
+            ):
+                appended_ranks = [ranks[name] for name in appended]
+                # Nodes are often added in rank order already
+                if appended_ranks != sorted(appended_ranks):
+                    for name in sorted(appended, key=ranks.get):
+                        self._nodes[name] = self._nodes.pop(name)
+            else:
+                self._sorted = False
+        self._ranked = True
 
-    def refresh_nodes(self):
+    def refresh_nodes(self, incremental: bool = False):
         """
         Re-evaluates and updates the values of all nodes in the collection,
         especially calculated nodes, based on their dependencies.
 
+        Parameters
+        ----------
+        incremental : bool, optional
+            Whether to only re-evaluate stale nodes, i.e. those downstream of inputs changed since
+            the last refresh, by default False.
+
         This method performs the following steps:
-        1. Re-ranks all nodes to ensure correct evaluation order based on dependencies.
-        2. Iterates through the ranked nodes and, for each CalculatedNode,
-           safely evaluates its definition using the current values of its
-           dependent nodes.
+        1. Gets the compiled evaluation plan, ranking the nodes and compiling their
+           definitions only if the collection changed since the plan was last built.
+        2. Runs the plan, evaluating each CalculatedNode (or each stale one, if incremental)
+           in rank order using the current values of its dependent nodes.
         3. Logs warnings if no calculated node is designated as a Key Performance Indicator (KPI).
         """
-        self._rank_nodes()
-        ordered_list = [node for node in self.nodes]
-        logging.debug(f"Ordered list: {ordered_list}")
+        plan = self.get_evaluation_plan()
 
-        if not any(node.is_kpi for node in self.nodes.values()):
+        if not plan.has_kpi:
             logging.warning("No calculated node designated in the nodes collection.")
 
-        for item in ordered_list:
-            node = self.nodes[item]
-            if isinstance(node, CalculatedNode):
-                import ast
+        if incremental:
+            stale, self._stale = self._stale, set()
+            plan.run(stale, tracer=self.tracer)
+        else:
+            self._stale = set()
+            plan.run(tracer=self.tracer)
 
-                # Create a safe dictionary of variables, add `__builtins__` for constants
-                safe_dict = {
-                    var: self.nodes[var].value
-                    for var in re.findall(r"\b\w+\b", node.definition)
-                    if var in self.nodes and self.nodes[var].value is not None
-                }
+    def evaluate_batch(self, inputs: dict, outputs: Optional[list] = None) -> dict:
+        """
+        Evaluate all nodes over arrays of input values in one vectorized pass.
 
-                # Parse the definition into an AST node
-                node_ast = ast.parse(node.definition, mode="eval")
+        Node values are not modified. Input nodes missing from `inputs` are held at their
+        current value.
 
-                # Define a safe eval function
-                def safe_eval(node_ast, safe_dict):
-                    try:
-                        logging.debug(
-                            f"Evaluating AST: {ast.dump(node_ast)} with safe_dict: {safe_dict}"
-                        )
-                        code = compile(node_ast, "<string>", "eval")
-                        result = eval(
-                            code,
-                            {"__builtins__": None},
-                            {**safe_dict, **{"__builtins__": None}},
-                        )
-                        logging.debug(f"Result of evaluation: {result}")
-                        return result
-                    except Exception as e:
-                        logging.error(f"Error during safe_eval: {e}")
-                        raise
-
-                # Evaluate the node definition safely
-                node.update_value(safe_eval(node_ast, safe_dict))
+        When `outputs` are given, inputs passed as scalars or left out are constant over the
+        batch: they are folded into the fused evaluator along with every node depending only on
+        them, so only the uncertain part of the graph is evaluated over the arrays.
+
+        Parameters
+        ----------
+        inputs : dict[str, np.ndarray]
+            Dictionary with input node names as keys and arrays of values as values.
+            All arrays must be broadcastable to a common shape.
+        outputs : Optional[list], optional
+            Names of the nodes to return, by default None returns all nodes. When given, the
+            outputs are computed by a fused evaluator (see EvaluationPlan.fused_evaluator),
+            without materialising intermediate nodes.
+
+        Returns
+        -------
+        dict[str, np.ndarray]
+            Dictionary with every node name (or each of `outputs`) as key and the array of its
+            values as value, each with the common shape of the inputs.
+
+        Raises
+        ------
+        ValueError
+            If a key of `inputs` is not the name of an input node.
+        """
+        for name in inputs:
+            if isinstance(self.get_node(name), CalculatedNode):
+                raise ValueError(f"Cannot set value for calculated node '{name}'.")
+        values = {
+            node.name: np.asarray(inputs.get(node.name, node.value), dtype=float)
+            for node in self.get_input_nodes()
+        }
+        shape = np.broadcast_shapes(*[value.shape for value in values.values()])
+        if outputs is None:
+            self.get_evaluation_plan().evaluate(values)
+            outputs = self.nodes
+        else:
+            for name in outputs:
+                self.get_node(name)
+            constants = {
+                name: float(value) for name, value in values.items() if value.ndim == 0
+            }
+            evaluator = self.get_evaluation_plan().fused_evaluator(outputs, constants)
+            values.update(evaluator(values))
+        return {
+            name: np.broadcast_to(values[name], shape).astype(float) for name in outputs
+        }
+
+    def trace_scenario(self, values: Optional[dict] = None) -> RecordingTracer:
+        """
+        Evaluate a single scenario with tracing enabled, without modifying the nodes.
+
+        Parameters
+        ----------
+        values : Optional[dict], optional
+            Values of input nodes by name, by default None. Other inputs are held at their
+            current value.
+
+        Returns
+        -------
+        RecordingTracer
+            Tracer holding the inputs, output and timing of each calculated node, in evaluation order.
+        """
+        values = values or {}
+        for name in values:
+            if isinstance(self.get_node(name), CalculatedNode):
+                raise ValueError(f"Cannot set value for calculated node '{name}'.")
+        tracer = RecordingTracer()
+        self.get_evaluation_plan().evaluate(
+            {
+                node.name: values.get(node.name, node.value)
+                for node in self.get_input_nodes()
+            },
+            tracer=tracer,
+        )
+        return tracer
 
     def reset_input_nodes(self):
         # STILL DOESN'T WORK
@@ -0,0 +1,274 @@
+import ast
+import math
+import operator as operators
+
+import numpy as np
+
+_BINARY_OPERATORS = {
+    ast.Add: "+",
+    ast.Sub: "-",
+    ast.Mult: "*",
+    ast.Div: "/",
+    ast.FloorDiv: "//",
+    ast.Pow: "**",
+}
+_UNARY_OPERATORS = {ast.UAdd: "+", ast.USub: "-"}
+_BINARY_FUNCTIONS = {
+    "+": operators.add,
+    "-": operators.sub,
+    "*": operators.mul,
+    "/": operators.truediv,
+    "//": operators.floordiv,
+    "**": operators.pow,
+}
+_UNARY_FUNCTIONS = {"+": operators.pos, "-": operators.neg}
+# Operators whose operands can be swapped without changing the result, even in floating point
+_COMMUTATIVE = {"+", "*"}
+# Nesting depth above which subexpressions go to temporaries, to stay clear of parser limits
+_MAX_NESTING = 50
+
+
+class ExpressionGraph:
+    """
+    Expression DAG of a set of node definitions, with every calculated node inlined.
+
+    Each expression is stored once (hash-consing), so subexpressions shared by several
+    definitions, directly or through intermediate nodes, become a single entry. Expressions are
+    tuples referencing other expressions by index, and are numbered in creation order, which is
+    a topological order.
+
+    Inputs with a known, fixed value are replaced by constants, and operations on constants
+    (numeric literals included) are folded as the graph is built, so any subgraph that does not
+    depend on a variable input reduces to a single constant.
+
+    Fixed inputs are held as np.float64, like the 0-d arrays they replace, so operations on
+    them follow NumPy semantics (e.g. division by zero gives inf rather than raising).
+    """
+
+    def __init__(self, definitions: dict, constants: dict = None):
+        """
+        Parameters
+        ----------
+        definitions : dict
+            Dictionary of calculated node name to definition, preferably in evaluation order
+            so that nodes are built without recursion. Names that are not in the dictionary
+            are treated as inputs.
+        constants : dict, optional
+            Dictionary of input name to fixed value, by default None. Only finite values are
+            folded, other inputs stay variable.
+        """
+        self.definitions = definitions
+        self.constants = {
+            name: value
+            for name, value in (constants or {}).items()
+            if value is not None and math.isfinite(value)
+        }
+        self.expressions = []
+        self._ids = {}
+        self._node_ids = {}
+        for name in definitions:
+            self.node(name)
+
+    def _add(self, expression: tuple) -> int:
+        key = expression
+        if expression[0] == "constant":
+            # Keep 2 and 2.0, or 0.0 and -0.0, apart
+            key = ("constant", type(expression[1]), repr(expression[1]))
+        if key not in self._ids:
+            self._ids[key] = len(self.expressions)
+            self.expressions.append(expression)
+        return self._ids[key]
+
+    def _fold(self, function, *operands) -> int:
+        """Add the constant result of an operation on constants.
+
+        Returns None if the operation fails or does not give a finite number, in which case it
+        is left to be evaluated at run time, with the same outcome as without folding.
+        """
+        try:
+            with np.errstate(all="ignore"):
+                value = function(*[self.expressions[i][1] for i in operands])
+            if not math.isfinite(value):
+                return None
+        except (ArithmeticError, TypeError, ValueError):
+            return None
+        return self._add(("constant", value))
+
+    def is_constant(self, expression_id: int) -> bool:
+        """Whether an expression has been folded into a constant."""
+        return self.expressions[expression_id][0] == "constant"
+
+    def node(self, name: str) -> int:
+        """Get the index of the expression of a node, building it if needed."""
+        if name not in self._node_ids:
+            if name in self.definitions:
+                tree = ast.parse(self.definitions[name], mode="eval")
+                self._node_ids[name] = self._build(tree.body, name)
+            elif name in self.constants:
+                self._node_ids[name] = self._add(
+                    ("constant", np.float64(self.constants[name]))
+                )
+            else:
+                self._node_ids[name] = self._add(("input", name))
+        return self._node_ids[name]
+
+    def _build(self, tree: ast.AST, name: str) -> int:
+        if isinstance(tree, ast.Name):
+            return self.node(tree.id)
+        if isinstance(tree, ast.Constant):
+            return self._add(("constant", tree.value))
+        if isinstance(tree, ast.BinOp) and type(tree.op) in _BINARY_OPERATORS:
+            operator = _BINARY_OPERATORS[type(tree.op)]
+            left = self._build(tree.left, name)
+            right = self._build(tree.right, name)
+            if self.is_constant(left) and self.is_constant(right):
+                folded = self._fold(_BINARY_FUNCTIONS[operator], left, right)
+                if folded is not None:
+                    return folded
+            if operator in _COMMUTATIVE and right < left:
+                left, right = right, left
+            return self._add(("binary", operator, left, right))
+        if isinstance(tree, ast.UnaryOp) and type(tree.op) in _UNARY_OPERATORS:
+            operator = _UNARY_OPERATORS[type(tree.op)]
+            operand = self._build(tree.operand, name)
+            if self.is_constant(operand):
+                folded = self._fold(_UNARY_FUNCTIONS[operator], operand)
+                if folded is not None:
+                    return folded
+            return self._add(("unary", operator, operand))
+        raise ValueError(
+            f"Unsupported expression '{ast.unparse(tree)}' in definition of node '{name}'."
+        )
+
+
+class FusedEvaluator:
+    """
+    A single compiled function evaluating a set of output nodes from the input nodes.
+
+    The definitions reachable from each output are inlined into one expression DAG, common
+    subexpressions are shared across outputs, and the DAG is emitted as straight-line Python.
+    Subexpressions used more than once are stored in temporaries, all others are nested in
+    their parent expression. Intermediate nodes are never materialised.
+
+    Inputs given as constants are folded into the evaluator along with everything that only
+    depends on them, so only the part of the graph downstream of the variable inputs is
+    evaluated on each call.
+
+    As the definitions only use arithmetic operators, the evaluator works on scalars and on
+    NumPy arrays alike.
+    """
+
+    def __init__(self, definitions: dict, outputs: list, constants: dict = None):
+        """
+        Parameters
+        ----------
+        definitions : dict
+            Dictionary of calculated node name to definition.
+        outputs : list
+            Names of the nodes to evaluate.
+        constants : dict, optional
+            Dictionary of input name to fixed value, folded into the evaluator, by default None.
+        """
+        self.outputs = list(outputs)
+        graph = ExpressionGraph(definitions, constants)
+        output_ids = [graph.node(name) for name in self.outputs]
+
+        # Only keep the expressions the outputs depend on, renumbered in topological order
+        reachable = set(output_ids)
+        for i in range(len(graph.expressions) - 1, -1, -1):
+            if i in reachable:
+                # Operands follow the kind and operator, inputs and constants have none
+                reachable.update(graph.expressions[i][2:])
+        kept = sorted(reachable)
+        renumber = {old: new for new, old in enumerate(kept)}
+        self.expressions = []
+        for old in kept:
+            expression = graph.expressions[old]
+            self.expressions.append(
+                expression[:2] + tuple(renumber[child] for child in expression[2:])
+            )
+        output_ids = [renumber[i] for i in output_ids]
+
+        self.inputs = [
+            expression[1] for expression in self.expressions if expression[0] == "input"
+        ]
+        self.source = self._generate_source(output_ids)
+        namespace = {}
+        exec(
+            compile(self.source, "<fused>", "exec"),
+            {"__builtins__": None, **self._constants},
+            namespace,
+        )
+        self._function = namespace["fused"]
+
+    def _generate_source(self, output_ids: list) -> str:
+        """Generate the source of the fused function."""
+        uses = [0] * len(self.expressions)
+        for expression in self.expressions:
+            for child in expression[2:]:
+                uses[child] += 1
+        for output in output_ids:
+            uses[output] += 1
+
+        # Fixed inputs feeding operations that could not be folded keep their np.float64 type,
+        # so these operations behave as on the 0-d arrays of the unfused evaluation
+        unfolded_operands = set()
+        for expression in self.expressions:
+            children = expression[2:]
+            if children and all(self.expressions[c][0] == "constant" for c in children):
+                unfolded_operands.update(children)
+        self._constants = {}
+
+        arguments = {name: f"_x{i}" for i, name in enumerate(self.inputs)}
+        texts = []
+        depths = []
+        lines = []
+        for i, expression in enumerate(self.expressions):
+            kind = expression[0]
+            if kind == "input":
+                texts.append(arguments[expression[1]])
+                depths.append(0)
+                continue
+            if kind == "constant":
+                value = expression[1]
+                if isinstance(value, np.float64) and i in unfolded_operands:
+                    self._constants[f"_c{i}"] = value
+                    texts.append(f"_c{i}")
+                elif isinstance(value, np.float64):
+                    texts.append(repr(float(value)))
+                else:
+                    texts.append(repr(value))
+                depths.append(0)
+                continue
+            if kind == "binary":
+                text = (
+                    f"({texts[expression[2]]} {expression[1]} {texts[expression[3]]})"
+                )
+            else:
+                text = f"({expression[1]}{texts[expression[2]]})"
+            depth = 1 + max(depths[child] for child in expression[2:])
+            if uses[i] > 1 or depth > _MAX_NESTING:
+                lines.append(f"    _t{i} = {text}")
+                text = f"_t{i}"
+                depth = 0
+            texts.append(text)
+            depths.append(depth)
+
+        lines.append(f"    return ({''.join(texts[i] + ', ' for i in output_ids)})")
+        return "\n".join([f"def fused({', '.join(arguments.values())}):"] + lines)
+
+    def __call__(self, values: dict) -> dict:
+        """Evaluate the outputs.
+
+        Parameters
+        ----------
+        values : dict
+            Values of (at least) the inputs of the evaluator, by name.
+
+        Returns
+        -------
+        dict
+            Dictionary of output name to value.
+        """
+        results = self._function(*[values[name] for name in self.inputs])
+        return dict(zip(self.outputs, results))
@@ -0,0 +1,123 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from decision_analytics.nodes_collection import NodesCollection
+from decision_analytics.simulation import factorial_codes
+from decision_analytics.utils import values_map
+
+# Model rebuilt once in each worker process
+_worker_collection = None
+
+
+def _init_worker(model_json: str) -> None:
+    global _worker_collection
+    _worker_collection = NodesCollection()
+    _worker_collection.from_json_str(model_json)
+
+
+def _attach(name: str, shape: tuple) -> tuple:
+    """Attach to a shared memory block created by the parent process, as an array."""
+    # Workers share the parent's resource tracker, which unlinks the block if the parent dies
+    memory = shared_memory.SharedMemory(name=name)
+    return memory, np.ndarray(shape, dtype=float, buffer=memory.buf)
+
+
+def _evaluate_block(task: tuple) -> None:
+    """Evaluate the KPIs for a block of scenarios, decoding its inputs and writing outputs in place."""
+    outputs_name, outputs_shape, inputs, levels, constants, kpis, start, stop = task
+    codes = factorial_codes(len(inputs), start, stop)
+    outputs_memory, outputs = _attach(outputs_name, outputs_shape)
+    try:
+        batch = _worker_collection.evaluate_batch(
+            {
+                **{name: levels[i][codes[:, i]] for i, name in enumerate(inputs)},
+                **constants,
+            },
+            outputs=kpis,
+        )
+        for k, kpi in enumerate(kpis):
+            outputs[k, start:stop] = batch[kpi]
+    finally:
+        del outputs
+        outputs_memory.close()
+
+
+def evaluate_parallel(
+    nodes_collection: NodesCollection,
+    inputs: list,
+    levels: np.ndarray,
+    constants: dict,
+    kpis: list,
+    n_workers: int,
+    chunk_size: int = 100000,
+) -> dict:
+    """
+    Evaluate KPIs over the full factorial grid of some inputs on a pool of worker processes.
+
+    Workers decode the level codes of their block of scenarios themselves (see
+    factorial_codes), so the grid of input values is never built as a whole, and write the KPI
+    results in place in shared memory rather than returning pickled arrays. Each worker
+    rebuilds the model from its JSON representation once, then evaluates blocks of
+    `chunk_size` scenarios. Every scenario is evaluated by the same element-wise operations as in
+    NodesCollection.evaluate_batch, so the results are identical to the serial path.
+
+    Parameters
+    ----------
+    nodes_collection : NodesCollection
+        The model to evaluate.
+    inputs : list
+        Names of the input nodes to combine, in factorial order. Must hold at least one input.
+    levels : np.ndarray
+        Array of shape (len(inputs), 3) holding the low/mid/high values of each input.
+    constants : dict[str, float]
+        Values of the other input nodes, held constant.
+    kpis : list
+        Names of the nodes to evaluate.
+    n_workers : int
+        Number of worker processes.
+    chunk_size : int, optional
+        Number of scenarios evaluated per task, by default 100000.
+
+    Returns
+    -------
+    dict[str, np.ndarray]
+        Dictionary with each of `kpis` as key and the array of its values, in factorial order,
+        as value.
+    """
+    n_scenarios = len(values_map) ** len(inputs)
+    outputs_shape = (len(kpis), n_scenarios)
+    outputs_memory = shared_memory.SharedMemory(
+        create=True, size=max(int(np.prod(outputs_shape)) * 8, 1)
+    )
+    outputs = None
+    try:
+        tasks = [
+            (
+                outputs_memory.name,
+                outputs_shape,
+                inputs,
+                levels,
+                constants,
+                kpis,
+                start,
+                min(start + chunk_size, n_scenarios),
+            )
+            for start in range(0, n_scenarios, chunk_size)
+        ]
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=_init_worker,
+            initargs=(nodes_collection.to_json_str(),),
+        ) as executor:
+            # Consume the results to raise any error from the workers
+            list(executor.map(_evaluate_block, tasks))
+        outputs = np.ndarray(outputs_shape, dtype=float, buffer=outputs_memory.buf)
+        results = {kpi: outputs[k].copy() for k, kpi in enumerate(kpis)}
+    finally:
+        # Views of the block must be released before closing it
+        outputs = None
+        outputs_memory.close()
+        outputs_memory.unlink()
+    return results
@@ -1,4 +1,3 @@
-import re
 from decision_analytics import NodesCollection
 
 
@@ -22,9 +21,7 @@ flowchart TD
         mermaid_code += f"    {node.name}[{node.get_chart_str()}]:::{node_style}\n"
 
     for node in nodes_collection.get_calculated_nodes():
-        inputs = re.findall(r"\b\w+\b", node.definition)
-        for n in inputs:
-            n = n.strip()
+        for n in nodes_collection.get_parents(node.name):
             mermaid_code += f"    {n} --> {node.name}\n"
 
     mermaid_code += """
@@ -0,0 +1,468 @@
+import json
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from decision_analytics.aggregators import WeightedQuantileSketch
+from decision_analytics.simulation import (
+    factorial_weights,
+    level_labels,
+    scenario_weights,
+)
+from decision_analytics.utils import values_map
+
+# Number of scenarios read at once when scanning results stored on disk
+_SCAN_CHUNK_SIZE = 100000
+# Number of points of the quantile sketches used when scanning results stored on disk
+_SCAN_CAPACITY = 65536
+
+
+def _import_pyarrow():
+    """Import pyarrow, which is only needed to save results as Parquet."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as error:
+        raise ImportError(
+            "Saving results as Parquet requires pyarrow, install it with "
+            "`pip install decision_analytics[parquet]`."
+        ) from error
+    return pyarrow
+
+
+class SimulationResult:
+    """
+    Compact storage of the results of a simulation of the funnel.
+
+    Scenarios of a factorial simulation are stored as int8 level codes of the enumerated inputs,
+    from which input values, level labels and weights are derived on demand rather than stored.
+    Sampled scenarios (Monte Carlo) store the value of each sampled input instead. KPIs can be
+    kept in float32 to halve their size.
+
+    to_frame materialises the results as a dataframe, one row per scenario.
+
+    Results can also live on disk as a directory of .npy files, memory-mapped rather than
+    loaded (see create, save and open), for result sets larger than memory. Quantiles of such
+    results are computed by scanning the files in blocks.
+    """
+
+    def __init__(
+        self,
+        input_names: list,
+        levels: np.ndarray,
+        kpis: dict,
+        codes: Optional[np.ndarray] = None,
+        code_inputs: Optional[list] = None,
+        fixed_codes: Optional[dict] = None,
+        samples: Optional[dict] = None,
+        model: Optional[str] = None,
+    ):
+        """
+        Parameters
+        ----------
+        input_names : list
+            Names of all input nodes.
+        levels : np.ndarray
+            Array of shape (len(input_names), 3) of the value of each input at each level, as
+            returned by simulation.input_levels.
+        kpis : dict[str, np.ndarray]
+            Dictionary with KPI names as keys and the array of their value in each scenario.
+        codes : Optional[np.ndarray], optional
+            Array of shape (n_scenarios, len(code_inputs)) of level codes, for a factorial
+            simulation, by default None. A full grid must be in factorial order (see
+            factorial_codes).
+        code_inputs : Optional[list], optional
+            Names of the inputs in the columns of `codes`, by default None.
+        fixed_codes : Optional[dict], optional
+            Level code of inputs held at a level other than mid (e.g. when conditioning), by
+            default None. Other inputs outside `code_inputs` and `samples` are at mid.
+        samples : Optional[dict], optional
+            Dictionary with input names as keys and the array of their sampled values, for a
+            sampled simulation, by default None. Samples have equal weights.
+        model : Optional[str], optional
+            Fingerprint of the model that produced the results, by default None.
+        """
+        self.input_names = list(input_names)
+        self.levels = levels
+        self.kpis = kpis
+        self.codes = codes
+        self.code_inputs = list(code_inputs or [])
+        self.fixed_codes = dict(fixed_codes or {})
+        self.samples = samples
+        self.model = model
+        self.directory = None
+
+    def __len__(self):
+        return len(next(iter(self.kpis.values())))
+
+    @property
+    def is_factorial(self) -> bool:
+        """Whether the scenarios are level combinations, rather than samples."""
+        return self.samples is None
+
+    @property
+    def kpi_names(self) -> list:
+        return list(self.kpis)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the arrays of the results."""
+        arrays = list(self.kpis.values()) + list((self.samples or {}).values())
+        if self.codes is not None:
+            arrays.append(self.codes)
+        return sum(array.nbytes for array in arrays)
+
+    @property
+    def weights(self) -> np.ndarray:
+        """Probability weight of each scenario, recomputed from the level codes."""
+        if not self.is_factorial:
+            return np.full(len(self), 1 / len(self))
+        if len(self) == len(values_map) ** len(self.code_inputs):
+            # The full grid, in factorial order: the outer product of the level probabilities
+            return factorial_weights(len(self.code_inputs))
+        return scenario_weights(self.codes)
+
+    def input_codes(self, name: str) -> np.ndarray:
+        """Get the level code of an input in each scenario of a factorial simulation."""
+        if name in self.code_inputs:
+            return self.codes[:, self.code_inputs.index(name)]
+        return np.full(len(self), self.fixed_codes.get(name, 1), dtype=np.int8)
+
+    def input_values(self, name: str) -> np.ndarray:
+        """Get the value of an input in each scenario."""
+        if self.samples is not None and name in self.samples:
+            return self.samples[name]
+        levels = self.levels[self.input_names.index(name)]
+        return levels[self.input_codes(name)]
+
+    def labels(self, name: str) -> pd.Categorical:
+        """
+        Get the level label of an input in each scenario. Sampled inputs are not on a level,
+        their labels are missing.
+        """
+        if self.samples is not None and name in self.samples:
+            return level_labels(np.full(len(self), -1, dtype=np.int8))
+        return level_labels(self.input_codes(name))
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Materialise the results as a dataframe.
+
+        Returns
+        -------
+        pd.DataFrame
+            One row per scenario, with an {input}_value column per input, a column per KPI,
+            a categorical level label column per input (missing for sampled inputs), and the
+            weights. Factorial and sampled simulations have the same columns.
+        """
+        df = pd.DataFrame(
+            {
+                **{
+                    f"{name}_value": self.input_values(name)
+                    for name in self.input_names
+                },
+                **self.kpis,
+                **{name: self.labels(name) for name in self.input_names},
+            }
+        )
+        df["weights"] = self.weights
+        # Rows of factorial simulations are in factorial order, so each row's index is its
+        # mixed-radix scenario code
+        df.index.name = "scenario" if self.is_factorial else "sample"
+        return df
+
+    def take(
+        self, rows: np.ndarray, fixed: dict, kpis: Optional[list] = None
+    ) -> "SimulationResult":
+        """
+        Get the results of some scenarios of a factorial simulation, with inputs locked.
+
+        Parameters
+        ----------
+        rows : np.ndarray
+            Indices of the scenarios to keep, which must all have the inputs of `fixed` at the
+            given levels.
+        fixed : dict
+            Dictionary with input node names as keys and level codes as values.
+        kpis : Optional[list], optional
+            Names of the KPIs to keep, by default None keeps them all.
+
+        Returns
+        -------
+        SimulationResult
+            Results of the scenarios. Locked inputs are no longer enumerated, so the weights
+            are renormalised over the remaining inputs.
+        """
+        keep = [i for i, name in enumerate(self.code_inputs) if name not in fixed]
+        return SimulationResult(
+            self.input_names,
+            self.levels,
+            {
+                kpi: self.kpis[kpi][rows]
+                for kpi in (self.kpi_names if kpis is None else kpis)
+            },
+            codes=self.codes[rows][:, keep],
+            code_inputs=[self.code_inputs[i] for i in keep],
+            fixed_codes={**self.fixed_codes, **fixed},
+        )
+
+    def quantiles(self, kpi: str, q) -> np.ndarray:
+        """
+        Get weighted quantiles of a KPI, see np.quantile(..., method="inverted_cdf").
+
+        Results stored on disk are scanned in blocks through a WeightedQuantileSketch of 65536
+        points, so their quantiles are exact up to 65536 scenarios and approximate beyond that,
+        see WeightedQuantileSketch.
+        """
+        if self.directory is None:
+            return np.quantile(
+                self.kpis[kpi].astype(float),
+                q,
+                weights=self.weights,
+                method="inverted_cdf",
+            )
+        sketch = WeightedQuantileSketch(_SCAN_CAPACITY)
+        for start in range(0, len(self), _SCAN_CHUNK_SIZE):
+            stop = start + _SCAN_CHUNK_SIZE
+            if self.is_factorial:
+                weights = scenario_weights(self.codes[start:stop])
+            else:
+                weights = 1 / len(self)
+            sketch.add(self.kpis[kpi][start:stop], weights)
+        return sketch.quantile(q)
+
+    def tensor(self, kpi: str) -> np.ndarray:
+        """Get the values of a KPI of a full factorial simulation, with one axis per input."""
+        return self.kpis[kpi].reshape((len(values_map),) * len(self.code_inputs))
+
+    def _metadata(self) -> dict:
+        return {
+            "input_names": self.input_names,
+            "kpi_names": self.kpi_names,
+            "code_inputs": self.code_inputs,
+            "fixed_codes": self.fixed_codes,
+            "sampled_inputs": None if self.samples is None else list(self.samples),
+            "model": self.model,
+        }
+
+    def _write_metadata(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "levels.npy"), self.levels)
+        with open(os.path.join(directory, "metadata.json"), "w") as file:
+            json.dump(self._metadata(), file)
+
+    @classmethod
+    def create(
+        cls,
+        directory: str,
+        input_names: list,
+        levels: np.ndarray,
+        kpi_names: list,
+        code_inputs: list,
+        n_scenarios: int,
+        kpi_dtype: type = np.float64,
+        model: Optional[str] = None,
+        sampled_inputs: Optional[list] = None,
+    ) -> "SimulationResult":
+        """
+        Create the files of the results of a simulation, to be filled in place.
+
+        Codes (or samples) and KPIs are memory-mapped .npy files in `directory`, so the results
+        can be written block by block without ever being held in memory.
+
+        Parameters
+        ----------
+        directory : str
+            Directory of the files, created if needed.
+        input_names : list
+            Names of all input nodes.
+        levels : np.ndarray
+            Array of shape (len(input_names), 3) of the value of each input at each level.
+        kpi_names : list
+            Names of the KPIs.
+        code_inputs : list
+            Names of the enumerated inputs.
+        n_scenarios : int
+            Number of scenarios.
+        kpi_dtype : type, optional
+            Type the KPIs are stored as, by default np.float64.
+        model : Optional[str], optional
+            Fingerprint of the model that produces the results, by default None.
+        sampled_inputs : Optional[list], optional
+            Names of the sampled inputs, for a sampled simulation, by default None. Their
+            values are stored instead of codes, and `code_inputs` must be empty.
+
+        Returns
+        -------
+        SimulationResult
+            Results backed by the (zero-filled) files.
+        """
+        os.makedirs(directory, exist_ok=True)
+
+        def open_memmap(name, dtype, shape):
+            return np.lib.format.open_memmap(
+                os.path.join(directory, name), mode="w+", dtype=dtype, shape=shape
+            )
+
+        codes = samples = None
+        if sampled_inputs is None:
+            codes = open_memmap("codes.npy", np.int8, (n_scenarios, len(code_inputs)))
+        else:
+            samples = {
+                name: open_memmap(f"sample_{i}.npy", np.float64, (n_scenarios,))
+                for i, name in enumerate(sampled_inputs)
+            }
+        kpis = {
+            kpi: open_memmap(f"kpi_{i}.npy", kpi_dtype, (n_scenarios,))
+            for i, kpi in enumerate(kpi_names)
+        }
+        result = cls(
+            input_names,
+            levels,
+            kpis,
+            codes=codes,
+            code_inputs=code_inputs,
+            samples=samples,
+            model=model,
+        )
+        result._write_metadata(directory)
+        result.directory = directory
+        return result
+
+    def flush(self) -> None:
+        """Write the changes to results stored on disk."""
+        arrays = [self.codes] + list(self.kpis.values())
+        for array in arrays + list((self.samples or {}).values()):
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    def save(self, directory: str) -> None:
+        """
+        Save the results to a directory of .npy files, which open can memory-map.
+
+        Parameters
+        ----------
+        directory : str
+            Directory of the files, created if needed.
+        """
+        self._write_metadata(directory)
+        if self.codes is not None:
+            np.save(os.path.join(directory, "codes.npy"), self.codes)
+        for i, values in enumerate(self.kpis.values()):
+            np.save(os.path.join(directory, f"kpi_{i}.npy"), values)
+        for i, values in enumerate((self.samples or {}).values()):
+            np.save(os.path.join(directory, f"sample_{i}.npy"), values)
+
+    @classmethod
+    def open(cls, directory: str) -> "SimulationResult":
+        """
+        Open results saved to a directory, memory-mapping the files rather than reading them.
+
+        Opening is near-instant whatever the size of the results, and only the parts of the
+        files that are used are read from disk.
+
+        Parameters
+        ----------
+        directory : str
+            Directory written by create or save.
+
+        Returns
+        -------
+        SimulationResult
+            Results backed by the read-only files.
+        """
+        with open(os.path.join(directory, "metadata.json")) as file:
+            metadata = json.load(file)
+
+        def load(name):
+            return np.load(os.path.join(directory, name), mmap_mode="r")
+
+        samples = None
+        if metadata["sampled_inputs"] is not None:
+            samples = {
+                name: load(f"sample_{i}.npy")
+                for i, name in enumerate(metadata["sampled_inputs"])
+            }
+        result = cls(
+            metadata["input_names"],
+            np.load(os.path.join(directory, "levels.npy")),
+            {kpi: load(f"kpi_{i}.npy") for i, kpi in enumerate(metadata["kpi_names"])},
+            codes=None if samples is not None else load("codes.npy"),
+            code_inputs=metadata["code_inputs"],
+            fixed_codes=metadata["fixed_codes"],
+            samples=samples,
+            model=metadata["model"],
+        )
+        result.directory = directory
+        return result
+
+    def to_parquet(self, path: str) -> None:
+        """
+        Save the results to a Parquet file, which read_parquet reads back.
+
+        The file holds a column of level codes per enumerated input (or of values per sampled
+        input) and a column per KPI, named after the nodes and in their compact types. The
+        other attributes are stored as metadata of its schema. Requires pyarrow.
+
+        Parameters
+        ----------
+        path : str
+            Path of the file.
+        """
+        pyarrow = _import_pyarrow()
+        if self.is_factorial:
+            columns = {name: self.input_codes(name) for name in self.code_inputs}
+        else:
+            columns = dict(self.samples)
+        columns.update(self.kpis)
+        # Node names are unique, so inputs and KPIs cannot collide
+        table = pyarrow.table(
+            {name: np.asarray(values) for name, values in columns.items()}
+        )
+        metadata = {**self._metadata(), "levels": self.levels.tolist()}
+        table = table.replace_schema_metadata(
+            {"decision_analytics": json.dumps(metadata)}
+        )
+        pyarrow.parquet.write_table(table, path)
+
+    @classmethod
+    def read_parquet(cls, path: str) -> "SimulationResult":
+        """
+        Read results saved by to_parquet. Requires pyarrow.
+
+        Parameters
+        ----------
+        path : str
+            Path of the file.
+
+        Returns
+        -------
+        SimulationResult
+            The results.
+        """
+        pyarrow = _import_pyarrow()
+        table = pyarrow.parquet.read_table(path)
+        metadata = json.loads(table.schema.metadata[b"decision_analytics"])
+        kpis = {kpi: table.column(kpi).to_numpy() for kpi in metadata["kpi_names"]}
+        samples = codes = None
+        if metadata["sampled_inputs"] is not None:
+            samples = {
+                name: table.column(name).to_numpy()
+                for name in metadata["sampled_inputs"]
+            }
+        else:
+            codes = np.empty((len(table), len(metadata["code_inputs"])), np.int8)
+            for j, name in enumerate(metadata["code_inputs"]):
+                codes[:, j] = table.column(name).to_numpy()
+        return cls(
+            metadata["input_names"],
+            np.array(metadata["levels"], dtype=float),
+            kpis,
+            codes=codes,
+            code_inputs=metadata["code_inputs"],
+            fixed_codes=metadata["fixed_codes"],
+            samples=samples,
+            model=metadata["model"],
+        )
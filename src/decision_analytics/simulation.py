@@ -0,0 +1,399 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from scipy.stats import qmc
+
+from decision_analytics.utils import values_map
+
+
+def factorial_codes(
+    n_inputs: int, start: int = 0, stop: Optional[int] = None
+) -> np.ndarray:
+    """
+    Generate the full factorial grid of level codes for a number of inputs, or a block of it.
+
+    Rows are in the same order as itertools.product(values_map, repeat=n_inputs),
+    i.e. the last input varies fastest.
+
+    Parameters
+    ----------
+    n_inputs : int
+        Number of inputs to combine.
+    start : int, optional
+        Index of the first scenario, by default 0.
+    stop : Optional[int], optional
+        Index after the last scenario, by default None goes to the end of the grid.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (stop - start, n_inputs) holding the level code (0, 1 or 2)
+        of each input in each scenario, 3**n_inputs scenarios for the full grid.
+    """
+    n_levels = len(values_map)
+    if start == 0 and stop is None:
+        # Without inputs, the grid is the single scenario with every input at mid
+        grid = np.indices((n_levels,) * n_inputs, dtype=np.int8)
+        return grid.reshape(n_inputs, n_levels**n_inputs).T
+    stop = n_levels**n_inputs if stop is None else stop
+    # Decode the mixed-radix scenario codes of the block
+    scenarios = np.arange(start, stop, dtype=np.int64)[:, None]
+    return (scenarios // scenario_radix(n_inputs) % n_levels).astype(np.int8)
+
+
+def scenario_radix(n_inputs: int) -> np.ndarray:
+    """
+    Get the place value of each input in a mixed-radix scenario code.
+
+    A scenario's code is the sum over inputs of level code times place value, which is its row
+    index in factorial_codes(n_inputs), i.e. codes @ radix. Any combination of levels is thus
+    located by arithmetic, e.g. input j at high and all other inputs at mid is row
+    radix.sum() + radix[j].
+
+    Parameters
+    ----------
+    n_inputs : int
+        Number of inputs combined.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (n_inputs,) of place values, the last input being the least significant.
+    """
+    n_levels = len(values_map)
+    return n_levels ** np.arange(n_inputs - 1, -1, -1, dtype=np.int64)
+
+
+def one_at_a_time_codes(n_inputs: int) -> np.ndarray:
+    """
+    Generate the level codes of a one-at-a-time design for a number of inputs.
+
+    The first scenario has every input at its mid level, and each input then gets two scenarios
+    where it is at its low and high level while all others stay at mid.
+
+    Parameters
+    ----------
+    n_inputs : int
+        Number of inputs to vary.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (2 * n_inputs + 1, n_inputs). Row 0 is the base case, rows 2j+1 and
+        2j+2 have input j at its low and high level respectively.
+    """
+    codes = np.ones((2 * n_inputs + 1, n_inputs), dtype=np.int8)
+    codes[1::2][np.arange(n_inputs), np.arange(n_inputs)] = 0
+    codes[2::2][np.arange(n_inputs), np.arange(n_inputs)] = 2
+    return codes
+
+
+def input_levels(nodes: list) -> np.ndarray:
+    """
+    Get the low/mid/high values of input nodes as an array.
+
+    Inputs without percentile ranges are held at their current value on every level.
+
+    Parameters
+    ----------
+    nodes : list
+        List of input nodes.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (len(nodes), 3), where column j is the value used for level code j.
+    """
+    levels = np.empty((len(nodes), len(values_map)), dtype=float)
+    for i, node in enumerate(nodes):
+        if all([node.value_low, node.value_mid, node.value_high]):
+            levels[i] = [
+                getattr(node, values_map[code]["label"]) for code in values_map
+            ]
+        else:
+            levels[i] = node.value
+    return levels
+
+
+def ranged_inputs(levels: np.ndarray) -> np.ndarray:
+    """
+    Find the inputs whose value changes across levels.
+
+    Inputs without percentile ranges, or with a zero-width range, give identical scenarios on
+    every level and are left out of the factorial design.
+
+    Parameters
+    ----------
+    levels : np.ndarray
+        Array of shape (n_inputs, 3) as returned by input_levels.
+
+    Returns
+    -------
+    np.ndarray
+        Boolean array of shape (n_inputs,), True for the inputs to enumerate.
+    """
+    return levels.min(axis=1) != levels.max(axis=1)
+
+
+def scenario_values(levels: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """
+    Map level codes to input values.
+
+    Parameters
+    ----------
+    levels : np.ndarray
+        Array of shape (n_inputs, 3) as returned by input_levels.
+    codes : np.ndarray
+        Array of shape (n_scenarios, n_inputs) of level codes.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (n_scenarios, n_inputs) with the value of each input in each scenario.
+    """
+    return levels[np.arange(levels.shape[0]), codes]
+
+
+def scenario_weights(codes: np.ndarray) -> np.ndarray:
+    """
+    Calculate the probability weight of each scenario from its level codes.
+
+    Parameters
+    ----------
+    codes : np.ndarray
+        Array of shape (n_scenarios, n_inputs) of level codes.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (n_scenarios,), the product of the probabilities of each input's level.
+    """
+    return level_probabilities()[codes].prod(axis=1)
+
+
+def factorial_weights(n_inputs: int) -> np.ndarray:
+    """
+    Calculate the probability weight of each scenario of the full factorial grid.
+
+    The weights are the outer product of the level probabilities of every input, built one
+    input at a time, so they never go through the level codes.
+
+    Parameters
+    ----------
+    n_inputs : int
+        Number of inputs combined.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (3**n_inputs,), in the same order as factorial_codes(n_inputs).
+    """
+    pr = level_probabilities()
+    weights = np.ones(1)
+    for _ in range(n_inputs):
+        weights = np.multiply.outer(weights, pr).ravel()
+    return weights
+
+
+def level_labels(codes: np.ndarray) -> pd.Categorical:
+    """
+    Map level codes of one input to level labels (see values_map), as a categorical.
+
+    Parameters
+    ----------
+    codes : np.ndarray
+        Array of shape (n_scenarios,) of level codes.
+
+    Returns
+    -------
+    pd.Categorical
+        Categorical of the level labels, sharing the codes instead of holding strings.
+    """
+    labels = [details["label"] for details in values_map.values()]
+    return pd.Categorical.from_codes(codes, categories=labels)
+
+
+def level_probabilities() -> np.ndarray:
+    """Get the probability of each level code, as an array of shape (3,)."""
+    return np.array([values_map[code]["pr"] for code in values_map])
+
+
+def expected_over_levels(tensor: np.ndarray, keep: Optional[int] = None):
+    """
+    Calculate the expected value of a factorial result tensor over its input levels.
+
+    Each axis of the tensor is one input, and is contracted with the level probabilities, so
+    that no array of weights the size of the tensor is ever built.
+
+    Parameters
+    ----------
+    tensor : np.ndarray
+        Array of shape (3,) * n_inputs, indexed by the level code of each input.
+    keep : Optional[int], optional
+        Axis to keep, by default None contracts all axes.
+
+    Returns
+    -------
+    float or np.ndarray
+        The expected value, or the expected value at each level of the kept axis as an array
+        of shape (3,).
+    """
+    pr = level_probabilities()
+    result = tensor
+    # Contract from the last axis, so that the remaining axes keep their position
+    for axis in range(tensor.ndim - 1, -1, -1):
+        if axis != keep:
+            result = np.tensordot(result, pr, axes=([axis], [0]))
+    return result
+
+
+SAMPLERS = ("random", "sobol", "latin_hypercube")
+
+
+def sample_uniforms(
+    n_samples: int, n_inputs: int, sampler: str = "random", seed: Optional[int] = None
+) -> np.ndarray:
+    """
+    Draw uniform samples in the unit hypercube, one dimension per input.
+
+    Low-discrepancy designs (scrambled Sobol, Latin hypercube) cover the hypercube more evenly
+    than independent random draws, so quantiles of the outputs converge with fewer samples.
+
+    Parameters
+    ----------
+    n_samples : int
+        Number of samples. Sobol designs are best balanced with a power of 2.
+    n_inputs : int
+        Number of dimensions.
+    sampler : str, optional
+        One of "random", "sobol" or "latin_hypercube", by default "random".
+    seed : Optional[int], optional
+        Seed of the random number generator (or of the scrambling), by default None.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (n_samples, n_inputs) of values in [0, 1).
+
+    Raises
+    ------
+    ValueError
+        If the sampler is unknown.
+    """
+    if sampler not in SAMPLERS:
+        raise ValueError(f"Unknown sampler '{sampler}', expected one of {SAMPLERS}.")
+    if sampler == "random" or n_inputs == 0:
+        return np.random.default_rng(seed).random((n_samples, n_inputs))
+    if sampler == "sobol":
+        engine = qmc.Sobol(d=n_inputs, scramble=True, seed=seed)
+    else:
+        engine = qmc.LatinHypercube(d=n_inputs, seed=seed)
+    return engine.random(n_samples)
+
+
+def sample_uniform_blocks(
+    n_samples: int,
+    n_inputs: int,
+    sampler: str = "random",
+    seed: Optional[int] = None,
+    chunk_size: int = 100000,
+):
+    """
+    Draw the uniform samples of sample_uniforms in blocks, without holding them all in memory.
+
+    The blocks concatenate to the same array as sample_uniforms with the same arguments.
+    Sobol blocks are rounded down to a power of 2 samples, which keeps their balance.
+
+    Parameters
+    ----------
+    n_samples : int
+        Number of samples.
+    n_inputs : int
+        Number of dimensions.
+    sampler : str, optional
+        "random" or "sobol", by default "random". Latin hypercube designs stratify all the
+        samples at once and cannot be drawn in blocks.
+    seed : Optional[int], optional
+        Seed of the random number generator (or of the scrambling), by default None.
+    chunk_size : int, optional
+        Number of samples per block, by default 100000.
+
+    Returns
+    -------
+    Iterator[tuple]
+        Index of the first sample of each block, and array of shape (block size, n_inputs) of
+        values in [0, 1).
+
+    Raises
+    ------
+    ValueError
+        If the sampler is unknown or cannot be drawn in blocks.
+    """
+    if sampler not in SAMPLERS:
+        raise ValueError(f"Unknown sampler '{sampler}', expected one of {SAMPLERS}.")
+    if sampler == "latin_hypercube":
+        raise ValueError("Latin hypercube samples cannot be drawn in blocks.")
+    if sampler == "random" or n_inputs == 0:
+        rng = np.random.default_rng(seed)
+
+        def draw(n):
+            return rng.random((n, n_inputs))
+
+    else:
+        draw = qmc.Sobol(d=n_inputs, scramble=True, seed=seed).random
+        chunk_size = 2 ** int(np.log2(chunk_size))
+    return (
+        (start, draw(min(chunk_size, n_samples - start)))
+        for start in range(0, n_samples, chunk_size)
+    )
+
+
+def metalog_quantile(metalog, probabilities: np.ndarray) -> np.ndarray:
+    """
+    Vectorized quantile function of a fitted metalog distribution.
+
+    Gives the same values as MetaLogistic.quantile, which loops over probabilities in Python,
+    for a whole array of probabilities at once.
+
+    Parameters
+    ----------
+    metalog : MetaLogistic
+        Fitted metalog distribution.
+    probabilities : np.ndarray
+        Array of cumulative probabilities.
+
+    Returns
+    -------
+    np.ndarray
+        Array of quantiles, with the shape of `probabilities`.
+    """
+    p = np.asarray(probabilities, dtype=float)
+    a = metalog.a_vector
+    boundedness = metalog.boundedness
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ln_p_term = np.log(p / (1 - p))
+        p05_term = p - 0.5
+        quantile = a[0] + a[1] * ln_p_term
+        if metalog.term > 2:
+            quantile = quantile + a[2] * p05_term * ln_p_term
+        if metalog.term > 3:
+            quantile = quantile + a[3] * p05_term
+        for n in range(5, metalog.term + 1):
+            if n % 2 != 0:
+                quantile = quantile + a[n - 1] * p05_term ** ((n - 1) / 2)
+            else:
+                quantile = quantile + a[n - 1] * p05_term ** (n / 2 - 1) * ln_p_term
+
+        if boundedness == "lower":
+            quantile = metalog.lbound + np.exp(quantile)
+        if boundedness == "upper":
+            quantile = metalog.ubound - np.exp(-quantile)
+        if boundedness == "bounded":
+            quantile = (metalog.lbound + metalog.ubound * np.exp(quantile)) / (
+                1 + np.exp(quantile)
+            )
+
+    lowest = metalog.lbound if boundedness in ("lower", "bounded") else -np.inf
+    highest = metalog.ubound if boundedness in ("upper", "bounded") else np.inf
+    return np.where(p <= 0, lowest, np.where(p >= 1, highest, quantile))
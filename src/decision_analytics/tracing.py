@@ -0,0 +1,74 @@
+import time
+
+
+class Tracer:
+    """
+    Receives evaluation events from an EvaluationPlan.
+
+    This base class ignores all events and is the default tracer of a NodesCollection. As
+    `enabled` is False, the plan does not even gather the event data, so evaluations pay
+    nothing for tracing unless a tracer is explicitly enabled.
+    """
+
+    enabled = False
+
+    def start(self) -> None:
+        """Called before the first node of an evaluation."""
+
+    def node_evaluated(self, name: str, inputs: dict, output, seconds: float) -> None:
+        """Called after each calculated node is evaluated.
+
+        Parameters
+        ----------
+        name : str
+            Name of the calculated node.
+        inputs : dict
+            Values of the nodes referenced by the node's definition, by name.
+        output : float
+            Value of the node.
+        seconds : float
+            Time spent evaluating the node.
+        """
+
+    def finish(self) -> None:
+        """Called after the last node of an evaluation."""
+
+
+class RecordingTracer(Tracer):
+    """
+    Tracer recording every node evaluation, in evaluation order.
+
+    Meant for debugging a single scenario: records grow with every evaluation traced.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.records = []
+        self.seconds = 0.0
+        self._start = None
+
+    def start(self) -> None:
+        self._start = time.perf_counter()
+
+    def node_evaluated(self, name: str, inputs: dict, output, seconds: float) -> None:
+        self.records.append(
+            {"name": name, "inputs": inputs, "output": output, "seconds": seconds}
+        )
+
+    def finish(self) -> None:
+        self.seconds += time.perf_counter() - self._start
+
+    @property
+    def order(self) -> list:
+        """Names of the evaluated nodes, in evaluation order."""
+        return [record["name"] for record in self.records]
+
+    def __repr__(self):
+        lines = [
+            f"{record['name']} = {record['output']} <- {record['inputs']}"
+            for record in self.records
+        ]
+        return "\n".join(
+            [f"RecordingTracer with {len(self.records)} evaluations:"] + lines
+        )
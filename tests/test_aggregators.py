@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from decision_analytics.aggregators import SwingCells, WeightedQuantileSketch
+from decision_analytics.simulation import factorial_codes
+
+
+def test_quantile_sketch_exact_below_capacity():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=1000)
+    weights = rng.random(1000)
+    sketch = WeightedQuantileSketch(capacity=1000)
+    for start in range(0, 1000, 300):
+        sketch.add(values[start : start + 300], weights[start : start + 300])
+    q = [0.1, 0.5, 0.9]
+    np.testing.assert_array_equal(
+        sketch.quantile(q),
+        np.quantile(values, q, weights=weights, method="inverted_cdf"),
+    )
+    assert sketch.mean == pytest.approx(np.average(values, weights=weights))
+    assert sketch.std == pytest.approx(
+        np.sqrt(np.cov(values, aweights=weights, bias=True))
+    )
+
+
+def test_quantile_sketch_bounded_error_and_merge():
+    rng = np.random.default_rng(1)
+    values = rng.exponential(size=100000)
+    sketches = [WeightedQuantileSketch(capacity=500) for _ in range(2)]
+    for start in range(0, 100000, 10000):
+        sketches[start // 10000 % 2].add(values[start : start + 10000], 1.0)
+    sketches[0].merge(sketches[1])
+    sketch = sketches[0]
+    assert sketch.count == 100000
+    assert len(sketch._values) <= 500
+    for q in [0.1, 0.5, 0.9]:
+        # Within one bucket of probability mass
+        assert np.mean(values <= sketch.quantile(q)) == pytest.approx(q, abs=2 / 500)
+
+
+def test_swing_cells():
+    codes = factorial_codes(3)
+    values = codes @ np.array([100, 10, 1])
+    cells = SwingCells(3)
+    for start in range(0, 27, 5):
+        cells.add(codes[start : start + 5], values[start : start + 5])
+    np.testing.assert_array_equal(
+        cells.table(), [[11, 111, 211], [101, 111, 121], [110, 111, 112]]
+    )
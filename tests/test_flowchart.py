@@ -21,3 +21,21 @@ def test_generate_funnel_chart_mermaid_code():
     mermaid_code = generate_funnel_chart_mermaid_code(collection)
     assert "node1" in mermaid_code
     assert "calculated_node" in mermaid_code
+
+
+def test_generate_funnel_chart_mermaid_code_edges():
+    collection = NodesCollection()
+    collection.add_nodes(
+        [
+            {"name": "node1", "format_str": "", "node_type": "input", "value": 10},
+            {
+                "name": "calculated_node",
+                "definition": "node1 * 2 + node1",
+                "format_str": "",
+                "node_type": "calculation",
+            },
+        ]
+    )
+    mermaid_code = generate_funnel_chart_mermaid_code(collection)
+    assert mermaid_code.count("node1 --> calculated_node") == 1
+    assert "2 --> calculated_node" not in mermaid_code
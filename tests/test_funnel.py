@@ -59,20 +59,391 @@ def setup_nodes():
     return collection
 
 
-def test_simulate_input_variance():
+def test_simulate_input_variance(tmp_path):
     nodes_collection = setup_nodes()
     funnel = Funnel(nodes_collection=nodes_collection)
     input_var = funnel.simulate_input_variance()
-    input_var.to_csv("input_var.csv")
+    input_var.to_csv(tmp_path / "input_var.csv")
     assert isinstance(input_var, pd.DataFrame)
     assert "input1" in input_var.columns
 
 
-def test_calculate_inputs_swing():
+def test_calculate_inputs_swing(tmp_path):
     nodes_collection = setup_nodes()
     funnel = Funnel(nodes_collection=nodes_collection)
     funnel.simulate_input_variance()
     input_swing = funnel.calculate_inputs_swing()
-    input_swing.to_csv("input_swing.csv")
+    input_swing.to_csv(tmp_path / "input_swing.csv")
     assert isinstance(input_swing, pd.DataFrame)
     assert "output1_swing" in input_swing.columns
+
+
+def test_simulate_input_variance_values():
+    nodes_collection = setup_nodes()
+    funnel = Funnel(nodes_collection=nodes_collection)
+    input_var = funnel.simulate_input_variance()
+    assert len(input_var) == 27
+    assert (
+        input_var["output1"] == input_var["input1_value"] * input_var["input2_value"]
+    ).all()
+    row = input_var[
+        (input_var["input1"] == "value_high")
+        & (input_var["input2"] == "value_low")
+        & (input_var["input3"] == "value_mid")
+    ]
+    assert row["output2"].values[0] == 2 * 0.9
+    assert row["weights"].values[0] == 0.25 * 0.25 * 0.5
+
+
+def test_trace_scenario():
+    nodes_collection = setup_nodes()
+    funnel = Funnel(nodes_collection=nodes_collection)
+    tracer = funnel.trace_scenario({"input1": 2, "input2": 0})
+    output1 = tracer.records[tracer.order.index("output1")]
+    assert output1["inputs"] == {"input1": 12, "input2": 2}
+    assert output1["output"] == 24
+
+
+def test_simulate_input_variance_skips_fixed_inputs():
+    nodes_collection = setup_nodes()
+    nodes_collection.add_nodes(
+        [
+            {"name": "fixed", "format_str": "", "node_type": "input", "value": 5},
+            {
+                "name": "zero_width",
+                "format_str": "",
+                "node_type": "input",
+                "value": 2,
+                "value_low": 2,
+                "value_mid": 2,
+                "value_high": 2,
+            },
+            {
+                "name": "output3",
+                "definition": "input1 * fixed * zero_width",
+                "format_str": "",
+                "node_type": "calculation",
+                "is_kpi": True,
+            },
+        ]
+    )
+    funnel = Funnel(nodes_collection=nodes_collection)
+    input_var = funnel.simulate_input_variance()
+    assert funnel.ranged_input_names == ["input1", "input2", "input3"]
+    assert len(input_var) == 27
+    assert input_var["weights"].sum() == pytest.approx(1)
+    assert (input_var["output3"] == input_var["input1_value"] * 10).all()
+    input_swing = funnel.calculate_inputs_swing()
+    assert input_swing.loc["Fixed", "output3_swing"] == 0
+    assert input_swing.loc["Zero Width", "output3_swing"] == 0
+    assert input_swing.loc["Input1", "output3_swing"] == 40
+
+
+def setup_unranged_nodes():
+    collection = NodesCollection()
+    collection.add_nodes(
+        [
+            {"name": "fixed", "format_str": "", "node_type": "input", "value": 7},
+            {
+                "name": "k",
+                "definition": "fixed * 2",
+                "format_str": "",
+                "node_type": "calculation",
+                "is_kpi": True,
+            },
+        ]
+    )
+    return collection
+
+
+def test_simulate_without_ranged_inputs(tmp_path):
+    funnel = Funnel(nodes_collection=setup_unranged_nodes())
+    funnel.simulate()
+    assert funnel.ranged_input_names == []
+    assert len(funnel.sim_result) == 1
+    assert funnel.sim_result["k"].tolist() == [14]
+    assert funnel.sim_result["weights"].tolist() == [1]
+    assert funnel.input_swing_df.loc["Fixed", "k_swing"] == 0
+    assert funnel.input_swing_df.loc["Combined Uncertainty", "k_mid"] == 14
+    swing = funnel.simulate_inputs_swing()
+    assert swing.loc["Fixed", "k_value_low"] == 14
+    assert swing.loc["Fixed", "k_swing"] == 0
+    samples = funnel.simulate_monte_carlo(n_samples=10, seed=0)
+    assert (samples["k"] == 14).all()
+    streamed = funnel.simulate_streaming()
+    assert streamed.loc["Fixed", "k_value_low"] == 14
+    assert streamed.loc["Combined Uncertainty", "k_high"] == 14
+    path = funnel.simulate_shard(0, 1, str(tmp_path / "shard.npz"))
+    pd.testing.assert_frame_equal(funnel.merge_shards([path]), streamed)
+    with pytest.raises(ValueError, match="No KPI"):
+        Funnel(nodes_collection=NodesCollection()).simulate_monte_carlo()
+
+
+def test_simulate_inputs_swing_matches_factorial():
+    nodes_collection = setup_nodes()
+    funnel = Funnel(nodes_collection=nodes_collection)
+    funnel.simulate()
+    factorial_swing = funnel.input_swing_df
+    oat_swing = funnel.simulate_inputs_swing()
+    assert list(oat_swing.index) == ["Input1", "Input2", "Input3"]
+    for kpi in funnel.kpi_node_names:
+        for column in ["value_low", "value_mid", "value_high", "swing"]:
+            pd.testing.assert_series_equal(
+                oat_swing[f"{kpi}_{column}"],
+                factorial_swing.loc[oat_swing.index, f"{kpi}_{column}"].astype(float),
+            )
+    assert funnel.get_tornado_chart("output1") is not None
+
+
+def test_kpi_tensors():
+    import numpy as np
+
+    nodes_collection = setup_nodes()
+    funnel = Funnel(nodes_collection=nodes_collection)
+    input_var = funnel.simulate_input_variance()
+    tensor = funnel.get_kpi_tensor("output1")
+    assert tensor.shape == (3, 3, 3)
+    np.testing.assert_array_equal(tensor.ravel(), input_var["output1"])
+    # input1 at high, input2 at low, input3 at mid
+    assert tensor[2, 0, 1] == 24
+    conditional = funnel.get_kpi_tensor("output2", fixed={"input2": 2})
+    assert conditional.shape == (3, 3)
+    assert np.shares_memory(conditional, funnel.kpi_tensors["output2"])
+    expected = (input_var["output1"] * input_var["weights"]).sum()
+    assert funnel.expected_value("output1") == pytest.approx(expected)
+    assert funnel.expected_value("output1", fixed={"input1": 0}) == pytest.approx(
+        8 * (0.25 * 2 + 0.5 * 3 + 0.25 * 10)
+    )
+    marginal = funnel.marginal_expected_values("output1", "input1")
+    assert marginal["value_low"] == pytest.approx(8 * 4.5)
+
+
+def test_conditional():
+    nodes_collection = setup_nodes()
+    funnel = Funnel(nodes_collection=nodes_collection)
+    funnel.simulate()
+    conditional = funnel.conditional("output1", fixed={"input2": 2})
+    assert conditional.kpi_node_names == ["output1"]
+    assert len(conditional.sim_result) == 9
+    assert (conditional.sim_result["input2"] == "value_high").all()
+    assert conditional.sim_result["weights"].sum() == pytest.approx(1)
+    swing_df = conditional.input_swing_df
+    assert swing_df.loc["Input2", "output1_swing"] == 0
+    assert swing_df.loc["Input1", "output1_swing"] == (12 - 8) * 10
+    assert swing_df.loc["Combined Uncertainty", "output1_mid"] == 100
+    assert conditional.get_metalog("output1") is not None
+    # The original results are left untouched
+    assert len(funnel.sim_result) == 27
+    with pytest.raises(ValueError):
+        funnel.conditional("output1", fixed={"input2": "value_high"})
+
+
+def test_simulate_monte_carlo():
+    nodes_collection = setup_nodes()
+    funnel = Funnel(nodes_collection=nodes_collection)
+    samples = funnel.simulate_monte_carlo(n_samples=20000, seed=1)
+    assert len(samples) == 20000
+    assert (
+        samples["output1"] == samples["input1_value"] * samples["input2_value"]
+    ).all()
+    # Each input is sampled from a distribution with its low/mid/high as p10/p50/p90
+    assert samples["input1_value"].quantile([0.1, 0.5, 0.9]).tolist() == pytest.approx(
+        [8, 10, 12], abs=0.1
+    )
+    swing_df = funnel.input_swing_df
+    assert swing_df.loc["Input2", "output1_swing"] == 80
+    assert "output1_mid" in swing_df.columns
+    assert funnel.get_metalog("output1") is not None
+    assert list(samples.columns) == list(funnel.simulate_input_variance().columns)
+    assert samples["input1"].isna().all()
+    repeated = Funnel(nodes_collection).simulate_monte_carlo(n_samples=20000, seed=1)
+    pd.testing.assert_frame_equal(samples, repeated)
+
+
+def test_simulate_monte_carlo_sobol():
+    nodes_collection = setup_nodes()
+    funnel = Funnel(nodes_collection=nodes_collection)
+    samples = funnel.simulate_monte_carlo(n_samples=1024, seed=3, sampler="sobol")
+    assert len(samples) == 1024
+    assert samples["input1_value"].quantile([0.1, 0.5, 0.9]).tolist() == pytest.approx(
+        [8, 10, 12], abs=0.05
+    )
+
+
+def test_simulate_streaming():
+    nodes_collection = setup_nodes()
+    funnel = Funnel(nodes_collection=nodes_collection)
+    funnel.simulate()
+    expected = funnel.input_swing_df.astype(float)
+    streamed = funnel.simulate_streaming(chunk_size=4)
+    pd.testing.assert_frame_equal(streamed, expected)
+    assert funnel.sim_result.empty
+    assert funnel.kpi_sketches["output1"].count == 27
+    # Below capacity, the sketch keeps every scenario
+    expected = Funnel(nodes_collection=nodes_collection)
+    expected.simulate()
+    streamed_chart = funnel.get_cumulative_chart("output1").data[0]
+    chart = expected.get_cumulative_chart("output1").data[0]
+    assert list(streamed_chart.x) == list(chart.x)
+    assert streamed_chart.y[-1] == pytest.approx(1)
+    with pytest.raises(ValueError):
+        Funnel(nodes_collection=nodes_collection).get_cumulative_chart("output1")
+
+
+def test_calculate_inputs_swing_needs_factorial_results():
+    funnel = Funnel(nodes_collection=setup_nodes())
+    with pytest.raises(ValueError):
+        funnel.calculate_inputs_swing()
+    funnel.simulate_monte_carlo(n_samples=100, seed=1)
+    with pytest.raises(ValueError):
+        funnel.calculate_inputs_swing()
+    funnel.simulate_streaming()
+    with pytest.raises(ValueError):
+        funnel.calculate_inputs_swing()
+    funnel.simulate()
+    funnel.sim_result = funnel.sim_result.head(3)
+    with pytest.raises(ValueError):
+        funnel.calculate_inputs_swing()
+
+
+def test_simulate_input_variance_parallel():
+    nodes_collection = setup_nodes()
+    funnel = Funnel(nodes_collection=nodes_collection)
+    serial = funnel.simulate_input_variance()
+    parallel = funnel.simulate_input_variance(n_workers=2, chunk_size=5)
+    pd.testing.assert_frame_equal(parallel, serial)
+
+
+def test_simulate_shards_and_merge(tmp_path):
+    nodes_collection = setup_nodes()
+    funnel = Funnel(nodes_collection=nodes_collection)
+    expected = funnel.simulate_streaming()
+    paths = [
+        funnel.simulate_shard(k, 4, str(tmp_path / f"shard_{k}.npz"), chunk_size=2)
+        for k in range(4)
+    ]
+    merged = Funnel(nodes_collection=nodes_collection).merge_shards(paths[::-1])
+    pd.testing.assert_frame_equal(merged, expected)
+    with pytest.raises(ValueError):
+        funnel.merge_shards(paths[:3])
+    with pytest.raises(ValueError):
+        funnel.merge_shards([])
+
+    # Simulations reset the value of ranged inputs, which is not part of the model
+    other = Funnel(nodes_collection=setup_nodes())
+    first = other.simulate_shard(0, 2, str(tmp_path / "first.npz"))
+    other.simulate()
+    second = other.simulate_shard(1, 2, str(tmp_path / "second.npz"))
+    pd.testing.assert_frame_equal(other.merge_shards([first, second]), expected)
+    nodes_collection.get_node("input1").value_high = 13
+    with pytest.raises(ValueError):
+        funnel.merge_shards(paths)
+
+
+def test_merge_shards_maps_kpis_by_name(tmp_path):
+    funnel = Funnel(nodes_collection=setup_nodes())
+    expected = funnel.simulate_streaming()
+    paths = [
+        funnel.simulate_shard(k, 2, str(tmp_path / f"shard_{k}.npz")) for k in range(2)
+    ]
+    nodes_collection = setup_nodes()
+    nodes_collection.get_node("output1").is_kpi = False
+    merged = Funnel(nodes_collection=nodes_collection).merge_shards(paths)
+    output2 = [c for c in expected.columns if "output2" in c]
+    pd.testing.assert_frame_equal(merged, expected[output2])
+
+    funnel.kpi_node_names = ["output2"]
+    paths = [
+        funnel.simulate_shard(k, 2, str(tmp_path / f"shard_{k}.npz")) for k in range(2)
+    ]
+    with pytest.raises(ValueError):
+        Funnel(nodes_collection=setup_nodes()).merge_shards(paths)
+
+
+def test_compact_results():
+    import numpy as np
+
+    nodes_collection = setup_nodes()
+    funnel = Funnel(nodes_collection=nodes_collection)
+    funnel.simulate()
+    # The dataframe is only materialised on access
+    assert funnel._sim_result is None
+    assert funnel.results.codes.dtype == np.int8
+    expected = funnel.input_swing_df
+    funnel.simulate_input_variance(kpi_dtype=np.float32)
+    assert funnel.results.kpis["output1"].dtype == np.float32
+    assert funnel.sim_result["output1"].dtype == np.float32
+    pd.testing.assert_frame_equal(funnel.calculate_inputs_swing(), expected)
+
+
+def test_simulate_to_disk(tmp_path):
+    import numpy as np
+
+    nodes_collection = setup_nodes()
+    expected = Funnel(nodes_collection=setup_nodes()).simulate_streaming()
+    # Simulating resets the inputs to mid, which must not prevent reopening
+    funnel = Funnel(nodes_collection=nodes_collection)
+    directory = str(tmp_path / "results")
+    swing = funnel.simulate_to_disk(directory, chunk_size=2)
+    pd.testing.assert_frame_equal(swing, expected)
+    assert isinstance(funnel.kpi_tensors["output1"], np.memmap)
+    pd.testing.assert_frame_equal(funnel.open_results(directory), expected)
+
+    reopened = Funnel(nodes_collection=nodes_collection)
+    pd.testing.assert_frame_equal(reopened.open_results(directory), expected)
+    assert isinstance(reopened.results.kpis["output1"], np.memmap)
+    nodes_collection.get_node("input1").value_high = 13
+    with pytest.raises(ValueError):
+        Funnel(nodes_collection=nodes_collection).open_results(directory)
+
+
+def test_simulate_monte_carlo_to_disk(tmp_path):
+    import numpy as np
+
+    nodes_collection = setup_nodes()
+    funnel = Funnel(nodes_collection=nodes_collection)
+    expected = funnel.simulate_monte_carlo(n_samples=1024, seed=1, sampler="sobol")
+    expected_swing = funnel.input_swing_df
+    directory = str(tmp_path / "samples")
+    swing = funnel.simulate_monte_carlo_to_disk(
+        directory, n_samples=1024, seed=1, sampler="sobol", chunk_size=300
+    )
+    pd.testing.assert_frame_equal(swing, expected_swing)
+    assert isinstance(funnel.results.samples["input1"], np.memmap)
+    pd.testing.assert_frame_equal(funnel.sim_result, expected)
+
+    reopened = Funnel(nodes_collection=nodes_collection)
+    pd.testing.assert_frame_equal(reopened.open_results(directory), expected_swing)
+    pd.testing.assert_frame_equal(reopened.sim_result, expected)
+    with pytest.raises(ValueError):
+        funnel.simulate_monte_carlo_to_disk(directory, sampler="latin_hypercube")
+
+
+def test_save_and_load_results(tmp_path):
+    pytest.importorskip("pyarrow")
+    funnel = Funnel(nodes_collection=setup_nodes())
+    funnel.simulate()
+    funnel.save_results(str(tmp_path / "factorial"))
+    loaded = Funnel.load_results(str(tmp_path / "factorial"))
+    assert (
+        loaded.nodes_collection.to_json_str() == funnel.nodes_collection.to_json_str()
+    )
+    pd.testing.assert_frame_equal(loaded.input_swing_df, funnel.input_swing_df)
+    pd.testing.assert_frame_equal(loaded.sim_result, funnel.sim_result)
+    pd.testing.assert_frame_equal(
+        loaded.calculate_inputs_swing(), funnel.input_swing_df
+    )
+    loaded.get_tornado_chart("output1")
+
+    conditional = funnel.conditional("output2", {"input1": 2})
+    conditional.save_results(str(tmp_path / "conditional"))
+    loaded = Funnel.load_results(str(tmp_path / "conditional"))
+    assert loaded.kpi_node_names == ["output2"]
+    pd.testing.assert_frame_equal(
+        loaded.calculate_inputs_swing(), conditional.input_swing_df
+    )
+
+    funnel.simulate_monte_carlo(n_samples=100, seed=0)
+    funnel.save_results(str(tmp_path / "monte_carlo"))
+    loaded = Funnel.load_results(str(tmp_path / "monte_carlo"))
+    pd.testing.assert_frame_equal(loaded.sim_result, funnel.sim_result)
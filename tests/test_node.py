@@ -29,3 +29,23 @@ def test_node_without_value_for_input():
 def test_pretty_value():
     node = Node(name="node4", format_str=".2f", node_type="input", value=1234.56)
     assert node._pretty_value() == "1.23 K"
+
+
+def test_node_is_a_view_over_its_store():
+    node = Node(
+        name="node_five",
+        format_str="",
+        node_type="input",
+        value=10,
+        value_low=5,
+        value_mid=10,
+        value_high=15,
+    )
+    assert not hasattr(node, "__dict__")
+    assert node.long_name == "Node Five"
+    assert node.format_str == ".2f"
+    assert node.value_mid == 10
+    node.update_value(12)
+    assert node._store.value[node._idx] == 12
+    with pytest.raises(AttributeError):
+        node.unknown_attribute = 1
@@ -1,3 +1,4 @@
+import numpy as np
 import pytest
 
 from decision_analytics import NodesCollection
@@ -340,3 +341,467 @@ def test_repr():
         "NodesCollection with 2 nodes: 1 input nodes and 1 calculated nodes."
         == collection.__repr__()
     )
+
+
+def test_evaluation_plan_reused_between_refreshes():
+    collection = NodesCollection()
+    node1 = {"name": "node1", "format_str": "", "node_type": "input", "value": 10}
+    node2 = {
+        "name": "node2",
+        "format_str": "",
+        "node_type": "calculation",
+        "definition": "node1 * 2",
+    }
+    node3 = {
+        "name": "node3",
+        "format_str": "",
+        "node_type": "calculation",
+        "definition": "(node2 + node1) / 4",
+        "is_kpi": True,
+    }
+    collection.add_nodes([node1, node2, node3])
+    plan = collection.get_evaluation_plan()
+    assert plan.order == ["node2", "node3"]
+    assert plan.dependencies["node3"] == ["node2", "node1"]
+
+    collection.refresh_nodes()
+    assert collection.get_node("node3").value == 7.5
+    collection.set_node_values_from_dict({"node1": 2}, lookup=False)
+    collection.refresh_nodes()
+    assert collection.get_evaluation_plan() is plan
+    assert collection.get_node("node3").value == 1.5
+
+    collection.add_nodes(
+        [
+            {
+                "name": "node2",
+                "format_str": "",
+                "node_type": "calculation",
+                "definition": "node1 + 1",
+            }
+        ]
+    )
+    collection.refresh_nodes()
+    assert collection.get_evaluation_plan() is not plan
+    assert collection.get_node("node3").value == 1.25
+
+
+def test_evaluate_batch():
+    import numpy as np
+
+    collection = NodesCollection()
+    node1 = {"name": "node1", "format_str": "", "node_type": "input", "value": 10}
+    node2 = {"name": "node2", "format_str": "", "node_type": "input", "value": 3}
+    node3 = {
+        "name": "node3",
+        "format_str": "",
+        "node_type": "calculation",
+        "definition": "(node1 - node2) / 2",
+    }
+    node4 = {
+        "name": "node4",
+        "format_str": "",
+        "node_type": "calculation",
+        "definition": "2 + 1",
+    }
+    collection.add_nodes([node1, node2, node3, node4])
+    result = collection.evaluate_batch({"node1": np.array([10.0, 20.0, 30.0])})
+    np.testing.assert_allclose(result["node3"], [3.5, 8.5, 13.5])
+    np.testing.assert_allclose(result["node2"], [3, 3, 3])
+    np.testing.assert_allclose(result["node4"], [3, 3, 3])
+    # Node values are left untouched
+    assert collection.get_node("node1").value == 10
+    assert collection.get_node("node3").value is None
+
+    with pytest.raises(ValueError, match="Cannot set value for calculated node"):
+        collection.evaluate_batch({"node3": np.array([1.0])})
+
+
+def setup_two_branch_collection(lazy=False):
+    collection = NodesCollection(lazy=lazy)
+    collection.add_nodes(
+        [
+            {"name": "a", "format_str": "", "node_type": "input", "value": 1},
+            {"name": "b", "format_str": "", "node_type": "input", "value": 2},
+            {
+                "name": "from_a",
+                "format_str": "",
+                "node_type": "calculation",
+                "definition": "a * 10",
+            },
+            {
+                "name": "from_b",
+                "format_str": "",
+                "node_type": "calculation",
+                "definition": "b * 10",
+            },
+            {
+                "name": "total",
+                "format_str": "",
+                "node_type": "calculation",
+                "definition": "from_a + from_b",
+                "is_kpi": True,
+            },
+        ]
+    )
+    return collection
+
+
+def test_refresh_nodes_incremental():
+    collection = setup_two_branch_collection()
+    collection.refresh_nodes()
+    assert collection.get_stale_nodes() == []
+
+    collection.set_node_values_from_dict({"a": 3}, lookup=False)
+    assert [node.name for node in collection.get_stale_nodes()] == ["from_a", "total"]
+    # Bypasses change tracking, so from_b must not be recomputed by the incremental refresh
+    collection.get_node("b").value = 5
+    collection.refresh_nodes(incremental=True)
+    assert collection.get_node("from_a").value == 30
+    assert collection.get_node("from_b").value == 20
+    assert collection.get_node("total").value == 50
+
+    collection.get_node("b").update_value(4)
+    collection.refresh_nodes(incremental=True)
+    assert collection.get_node("total").value == 70
+    assert collection.get_stale_nodes() == []
+
+
+def test_lazy_collection_pulls_stale_ancestors():
+    collection = setup_two_branch_collection(lazy=True)
+    # Nothing has been evaluated yet, reading the KPI evaluates its ancestors
+    assert collection.get_node("total").value == 30
+    assert collection.get_stale_nodes() == []
+
+    collection.set_node_values_from_dict({"a": 2}, lookup=False)
+    assert collection.get_node("from_a").value == 20
+    assert [node.name for node in collection.get_stale_nodes()] == ["total"]
+    assert collection.get_node("total").value == 40
+
+
+def test_rank_nodes_reports_cycle_path():
+    collection = NodesCollection()
+    nodes = [
+        {"name": "node0", "format_str": "", "node_type": "input", "value": 1},
+        {
+            "name": "node1",
+            "format_str": "",
+            "node_type": "calculation",
+            "definition": "node0 + node3",
+        },
+        {
+            "name": "node2",
+            "format_str": "",
+            "node_type": "calculation",
+            "definition": "node1 * 2",
+        },
+        {
+            "name": "node3",
+            "format_str": "",
+            "node_type": "calculation",
+            "definition": "node2 - 1",
+        },
+    ]
+    with pytest.raises(
+        ValueError, match="Dependency cycle: node1 -> node3 -> node2 -> node1"
+    ):
+        collection.add_nodes(nodes)
+
+
+def test_rank_nodes_long_chain():
+    collection = NodesCollection()
+    nodes = [{"name": "node0", "format_str": "", "node_type": "input", "value": 1}]
+    nodes += [
+        {
+            "name": f"node{i}",
+            "format_str": "",
+            "node_type": "calculation",
+            "definition": f"node{i - 1} + 1",
+        }
+        for i in range(2000, 0, -1)
+    ]
+    collection.add_nodes(nodes)
+    assert collection.get_node("node2000").rank == 2000
+    assert list(collection.nodes)[:3] == ["node0", "node1", "node2"]
+    collection.refresh_nodes()
+    assert collection.get_node("node2000").value == 2001
+
+
+def test_dependency_queries():
+    collection = setup_two_branch_collection()
+    collection.add_nodes(
+        [{"name": "unused", "format_str": "", "node_type": "input", "value": 1}]
+    )
+    assert collection.get_parents("total") == ["from_a", "from_b"]
+    assert collection.get_children("a") == ["from_a"]
+    assert set(collection.ancestors("total")) == {"a", "b", "from_a", "from_b"}
+    assert collection.ancestors("a") == []
+    assert collection.descendants("a") == ["from_a", "total"]
+    assert collection.descendants("total") == []
+    assert set(collection.inputs_affecting("total")) == {"a", "b"}
+    assert collection.inputs_affecting("from_b") == ["b"]
+    assert collection.inputs_affecting("unused") == []
+    with pytest.raises(ValueError, match="Node 'nodeX' does not exist."):
+        collection.descendants("nodeX")
+
+
+def test_get_values_from_node_store():
+    import numpy as np
+
+    collection = setup_two_branch_collection()
+    collection.refresh_nodes()
+    np.testing.assert_allclose(collection.get_values(), [1, 2, 10, 20, 30])
+    np.testing.assert_array_equal(collection.get_values("rank"), [0, 0, 1, 1, 2])
+    assert np.isnan(collection.get_values("value_low")).all()
+    with pytest.raises(ValueError, match="'name' is not a numeric node attribute."):
+        collection.get_values("name")
+
+
+def test_removed_node_keeps_its_attributes():
+    collection = setup_two_branch_collection()
+    collection.refresh_nodes()
+    from_a = collection.get_node("from_a")
+    collection.add_nodes(
+        [{"name": "a", "format_str": ".1f", "node_type": "input", "value": 7}]
+    )
+    old_b = collection.get_node("b")
+    collection.remove_node("b")
+    assert old_b.value == 2
+    assert old_b.name == "b"
+    assert from_a.value == 10
+    assert collection.get_node("a").format_str == ".1f"
+    with pytest.raises(ValueError, match="Missing dependency: from_b -> b"):
+        collection.refresh_nodes()
+
+
+def test_removed_node_row_is_reused_empty():
+    collection = setup_two_branch_collection()
+    collection.refresh_nodes()
+    collection.remove_node("total")
+    collection.add_nodes(
+        [{"name": "c", "format_str": "", "node_type": "input", "value": 5}]
+    )
+    node = collection.get_node("c")
+    assert (node.value_low, node.rank, node.is_kpi) == (None, 0, False)
+
+
+def test_add_nodes_in_small_batches():
+    collection = NodesCollection()
+    collection.add_nodes(
+        [{"name": "node0", "format_str": "", "node_type": "input", "value": 1}]
+    )
+    for i in range(1, 300):
+        collection.add_nodes(
+            [
+                {
+                    "name": f"node{i}",
+                    "format_str": "",
+                    "node_type": "calculation",
+                    "definition": f"node{i - 1} + 1",
+                }
+            ]
+        )
+    collection.add_nodes(
+        [{"name": "late_input", "format_str": "", "node_type": "input", "value": 1}]
+    )
+    assert list(collection.nodes)[:2] == ["node0", "late_input"]
+    assert collection.get_node("node299").rank == 299
+    collection.refresh_nodes()
+    assert collection.get_node("node299").value == 300
+
+
+def test_add_nodes_replacement_reranks_downstream():
+    collection = setup_two_branch_collection()
+    collection.refresh_nodes()
+    collection.add_nodes(
+        [
+            {
+                "name": "b",
+                "format_str": "",
+                "node_type": "calculation",
+                "definition": "a + 1",
+            }
+        ]
+    )
+    assert collection.get_node("b").rank == 1
+    assert collection.get_node("from_b").rank == 2
+    assert collection.get_node("total").rank == 3
+    assert list(collection.nodes) == ["a", "b", "from_a", "from_b", "total"]
+    assert [node.name for node in collection.get_stale_nodes()] == [
+        "b",
+        "from_b",
+        "total",
+    ]
+    collection.refresh_nodes(incremental=True)
+    assert collection.get_node("total").value == 30
+
+    with pytest.raises(ValueError, match="Dependency cycle: a -> from_b -> b -> a"):
+        collection.add_nodes(
+            [
+                {
+                    "name": "a",
+                    "format_str": "",
+                    "node_type": "calculation",
+                    "definition": "from_b * 2",
+                }
+            ]
+        )
+
+
+def test_tracer_disabled_by_default():
+    collection = setup_two_branch_collection()
+    assert not collection.tracer.enabled
+    collection.refresh_nodes()
+    assert collection.get_node("total").value == 30
+
+
+def test_recording_tracer_on_refresh():
+    from decision_analytics.tracing import RecordingTracer
+
+    collection = setup_two_branch_collection()
+    collection.tracer = RecordingTracer()
+    collection.refresh_nodes()
+    assert collection.tracer.order == ["from_a", "from_b", "total"]
+    assert collection.tracer.records[-1]["inputs"] == {"from_a": 10, "from_b": 20}
+    assert collection.tracer.records[-1]["output"] == 30
+    assert collection.get_node("total").value == 30
+
+
+def test_trace_scenario():
+    collection = setup_two_branch_collection()
+    collection.refresh_nodes()
+    tracer = collection.trace_scenario({"a": 5})
+    assert tracer.order == ["from_a", "from_b", "total"]
+    assert tracer.records[0]["inputs"] == {"a": 5}
+    assert tracer.records[-1]["output"] == 70
+    # Nodes are left untouched
+    assert collection.get_node("total").value == 30
+
+
+def test_evaluate_batch_outputs():
+    import numpy as np
+
+    collection = setup_two_branch_collection()
+    result = collection.evaluate_batch({"a": np.array([1.0, 2.0])}, outputs=["total"])
+    assert list(result) == ["total"]
+    np.testing.assert_allclose(result["total"], [30, 40])
+
+
+def test_evaluate_batch_folds_constant_inputs():
+    import numpy as np
+
+    collection = setup_two_branch_collection()
+    result = collection.evaluate_batch(
+        {"a": np.array([1.0, 2.0]), "b": 3.0}, outputs=["total", "from_b"]
+    )
+    np.testing.assert_allclose(result["total"], [40, 50])
+    np.testing.assert_allclose(result["from_b"], [30, 30])
+    evaluator = collection.get_evaluation_plan().fused_evaluator(
+        ["total", "from_b"], {"b": 3.0}
+    )
+    assert evaluator.inputs == ["a"]
+
+
+def test_get_uncertain_nodes():
+    collection = setup_two_branch_collection()
+    assert collection.get_uncertain_nodes() == []
+    node_a = collection.get_node("a")
+    node_a.value_low, node_a.value_mid, node_a.value_high = 1, 2, 3
+    assert [node.name for node in collection.get_uncertain_nodes()] == [
+        "a",
+        "from_a",
+        "total",
+    ]
+
+
+def test_changing_definition_updates_plan():
+    collection = setup_two_branch_collection()
+    collection.refresh_nodes()
+    plan = collection.get_evaluation_plan()
+    collection.get_node("from_b").definition = "from_a * 2"
+    assert collection.get_node("from_b").rank == 2
+    assert collection.get_node("total").rank == 3
+    assert [node.name for node in collection.get_stale_nodes()] == ["from_b", "total"]
+    collection.refresh_nodes(incremental=True)
+    assert collection.get_evaluation_plan() is not plan
+    assert collection.get_node("total").value == 30
+    with pytest.raises(ValueError, match="not a valid input node"):
+        collection.get_node("from_b").definition = "missing + 1"
+
+
+def test_change_tracking_does_not_build_closures():
+    collection = setup_two_branch_collection(lazy=True)
+    collection.refresh_nodes()
+    collection.set_node_values_from_dict({"a": 3}, lookup=False)
+    assert collection.get_node("total").value == 50
+    assert collection._graph._closures is None
+
+
+def test_failed_add_nodes_keeps_reporting_error():
+    collection = setup_two_branch_collection()
+    with pytest.raises(ValueError, match="not a valid input node"):
+        collection.add_nodes(
+            [
+                {
+                    "name": "bad",
+                    "format_str": "",
+                    "node_type": "calculation",
+                    "definition": "missing + 1",
+                }
+            ]
+        )
+    with pytest.raises(ValueError, match="Unresolvable dependencies"):
+        collection.refresh_nodes()
+    collection.remove_node("bad")
+    collection.add_nodes(
+        [{"name": "c", "format_str": "", "node_type": "input", "value": 3}]
+    )
+    collection.refresh_nodes()
+    assert collection.get_node("total").value == 30
+
+
+def test_evaluate_batch_fixed_division_by_zero():
+    collection = NodesCollection()
+    collection.add_nodes(
+        [
+            {"name": "a", "format_str": "", "node_type": "input", "value": 1},
+            {"name": "b", "format_str": "", "node_type": "input", "value": 2},
+            {"name": "c", "format_str": "", "node_type": "input", "value": 0},
+            {
+                "name": "ratio",
+                "format_str": "",
+                "node_type": "calculation",
+                "definition": "b / c + a",
+                "is_kpi": True,
+            },
+        ]
+    )
+    inputs = {"a": np.array([1.0, 2.0])}
+    with np.errstate(divide="ignore"):
+        fused = collection.evaluate_batch(inputs, outputs=["ratio"])
+        unfused = collection.evaluate_batch(inputs)
+    np.testing.assert_array_equal(fused["ratio"], unfused["ratio"])
+    np.testing.assert_array_equal(fused["ratio"], [np.inf, np.inf])
+
+
+def test_add_nodes_interleaving_inputs_and_calculations():
+    collection = NodesCollection()
+    for i in range(5):
+        collection.add_nodes(
+            [
+                {"name": f"x{i}", "format_str": "", "node_type": "input", "value": 1},
+                {
+                    "name": f"y{i}",
+                    "format_str": "",
+                    "node_type": "calculation",
+                    "definition": f"x{i} + y{i - 1}" if i else f"x{i}",
+                },
+            ]
+        )
+    # Inputs added later rank before the calculated nodes added earlier
+    assert list(collection.nodes) == [f"x{i}" for i in range(5)] + [
+        f"y{i}" for i in range(5)
+    ]
+    assert [node.rank for node in collection] == [0] * 5 + [1, 2, 3, 4, 5]
+    collection.refresh_nodes()
+    assert collection.get_node("y4").value == 5
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from decision_analytics.optimizer import FusedEvaluator
+
+
+def test_fused_evaluator_inlines_intermediate_nodes():
+    definitions = {
+        "total_subscribers": "total_users * subscribe_rate",
+        "total_clicks": "total_subscribers * ctr",
+        "total_sales": "total_clicks * sale_success_rate",
+    }
+    fused = FusedEvaluator(definitions, ["total_sales"])
+    assert fused.inputs == ["total_users", "subscribe_rate", "ctr", "sale_success_rate"]
+    # Single-use intermediate nodes are nested, not stored
+    assert "_t" not in fused.source
+    result = fused(
+        {
+            "total_users": np.array([1000.0, 2000.0]),
+            "subscribe_rate": 0.5,
+            "ctr": 0.2,
+            "sale_success_rate": 0.1,
+        }
+    )
+    np.testing.assert_allclose(result["total_sales"], [10, 20])
+
+
+def test_fused_evaluator_eliminates_common_subexpressions():
+    definitions = {
+        "margin": "price - cost",
+        "profit": "(price - cost) * volume",
+        "profit_per_unit": "(cost * -1 + price) + margin * 0",
+        "scaled": "volume * margin",
+    }
+    fused = FusedEvaluator(definitions, ["profit", "scaled", "margin"])
+    # price - cost is computed once, and volume * margin is the same as profit
+    assert fused.source.count("-") == 1
+    assert fused.source.count("*") == 1
+    result = fused({"price": 5, "cost": 3, "volume": 10})
+    assert result == {"profit": 20, "scaled": 20, "margin": 2}
+
+
+def test_fused_evaluator_deep_chain():
+    definitions = {"node1": "node0 + 1"}
+    definitions.update({f"node{i}": f"node{i - 1} + 1" for i in range(2, 2000)})
+    fused = FusedEvaluator(definitions, ["node1999"])
+    assert fused({"node0": 1}) == {"node1999": 2000}
+
+
+def test_fused_evaluator_unsupported_expression():
+    with pytest.raises(ValueError, match="Unsupported expression"):
+        FusedEvaluator({"node1": "node0 % 2"}, ["node1"])
+
+
+def test_fused_evaluator_folds_constants():
+    definitions = {
+        "fixed_cost": "rent + salaries * 12",
+        "profit": "revenue * (1 - 0.25) - fixed_cost",
+    }
+    fused = FusedEvaluator(
+        definitions, ["profit", "fixed_cost"], {"rent": 1000.0, "salaries": 500.0}
+    )
+    assert fused.inputs == ["revenue"]
+    assert "7000.0" in fused.source and "0.75" in fused.source
+    result = fused({"revenue": np.array([10000.0, 20000.0])})
+    np.testing.assert_allclose(result["profit"], [500, 8000])
+    assert result["fixed_cost"] == 7000
+
+
+def test_fused_evaluator_does_not_fold_errors():
+    fused = FusedEvaluator({"ratio": "a / b"}, ["ratio"], {"a": 1.0, "b": 0.0})
+    # Fixed inputs divide like the 0-d arrays they stand for
+    with np.errstate(divide="ignore"):
+        assert fused({})["ratio"] == np.inf
+    fused = FusedEvaluator({"ratio": "1 / 0"}, ["ratio"])
+    with pytest.raises(ZeroDivisionError):
+        fused({})
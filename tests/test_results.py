@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from decision_analytics.results import SimulationResult
+from decision_analytics.simulation import factorial_codes
+
+
+def setup_result():
+    levels = np.array([[1.0, 2.0, 3.0], [10.0, 20.0, 40.0], [5.0, 5.0, 5.0]])
+    codes = factorial_codes(2)
+    kpis = {"kpi": (levels[0][codes[:, 0]] * levels[1][codes[:, 1]]).astype(np.float32)}
+    return SimulationResult(
+        ["a", "b", "fixed"], levels, kpis, codes=codes, code_inputs=["a", "b"]
+    )
+
+
+def test_simulation_result_to_frame():
+    result = setup_result()
+    assert len(result) == 9
+    assert result.nbytes == 9 * 2 + 9 * 4
+    df = result.to_frame()
+    assert list(df.columns) == [
+        "a_value",
+        "b_value",
+        "fixed_value",
+        "kpi",
+        "a",
+        "b",
+        "fixed",
+        "weights",
+    ]
+    assert df.index.name == "scenario"
+    assert isinstance(df["a"].dtype, pd.CategoricalDtype)
+    assert (df["fixed"] == "value_mid").all()
+    assert (df["fixed_value"] == 5).all()
+    row = df[(df["a"] == "value_high") & (df["b"] == "value_low")]
+    assert row["kpi"].values[0] == 30
+    assert row["weights"].values[0] == 0.25 * 0.25
+    assert df["weights"].sum() == 1
+
+
+def test_simulation_result_take():
+    result = setup_result()
+    locked = result.take(np.array([6, 7, 8]), {"a": 2})
+    assert locked.code_inputs == ["b"]
+    np.testing.assert_array_equal(locked.input_values("a"), [3, 3, 3])
+    np.testing.assert_array_equal(locked.weights, [0.25, 0.5, 0.25])
+    assert locked.quantiles("kpi", 0.5) == 60
+
+
+def test_simulation_result_save_and_open(tmp_path):
+    result = setup_result()
+    result.save(str(tmp_path))
+    opened = SimulationResult.open(str(tmp_path))
+    assert isinstance(opened.codes, np.memmap)
+    assert opened.code_inputs == ["a", "b"]
+    pd.testing.assert_frame_equal(opened.to_frame(), result.to_frame())
+    np.testing.assert_array_equal(
+        opened.quantiles("kpi", [0.1, 0.5, 0.9]),
+        result.quantiles("kpi", [0.1, 0.5, 0.9]),
+    )
+
+
+def test_simulation_result_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    result = setup_result()
+    path = str(tmp_path / "results.parquet")
+    result.to_parquet(path)
+    read = SimulationResult.read_parquet(path)
+    assert read.codes.dtype == np.int8
+    assert read.kpis["kpi"].dtype == np.float32
+    pd.testing.assert_frame_equal(read.to_frame(), result.to_frame())
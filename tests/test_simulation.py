@@ -0,0 +1,120 @@
+import itertools
+
+import numpy as np
+
+from decision_analytics import Node
+from decision_analytics.simulation import (
+    factorial_codes,
+    factorial_weights,
+    input_levels,
+    level_labels,
+    one_at_a_time_codes,
+    scenario_radix,
+    scenario_values,
+    scenario_weights,
+)
+
+
+def test_factorial_codes_order():
+    codes = factorial_codes(3)
+    assert codes.shape == (27, 3)
+    assert codes.tolist() == [list(c) for c in itertools.product([0, 1, 2], repeat=3)]
+    assert factorial_codes(0).shape == (1, 0)
+    assert factorial_codes(0, 0, 1).shape == (1, 0)
+
+
+def test_scenario_radix_indexes_factorial_rows():
+    codes = factorial_codes(4)
+    np.testing.assert_array_equal(codes @ scenario_radix(4), np.arange(81))
+    # Input 1 at high, all others at mid
+    row = scenario_radix(4).sum() + scenario_radix(4)[1]
+    assert codes[row].tolist() == [1, 2, 1, 1]
+
+
+def test_one_at_a_time_codes():
+    codes = one_at_a_time_codes(2)
+    assert codes.tolist() == [[1, 1], [0, 1], [2, 1], [1, 0], [1, 2]]
+
+
+def test_scenario_values_and_weights():
+    nodes = [
+        Node(
+            name="a",
+            format_str="",
+            node_type="input",
+            value=2,
+            value_low=1,
+            value_mid=2,
+            value_high=4,
+        ),
+        Node(name="b", format_str="", node_type="input", value=7),
+    ]
+    levels = input_levels(nodes)
+    np.testing.assert_allclose(levels, [[1, 2, 4], [7, 7, 7]])
+
+    codes = factorial_codes(2)
+    values = scenario_values(levels, codes)
+    np.testing.assert_allclose(values[:, 0], [1, 1, 1, 2, 2, 2, 4, 4, 4])
+    np.testing.assert_allclose(values[:, 1], 7)
+
+    weights = scenario_weights(codes)
+    assert weights[0] == 0.25 * 0.25
+    assert weights[4] == 0.5 * 0.5
+    assert np.isclose(weights.sum(), 1)
+
+
+def test_factorial_weights_and_labels():
+    codes = factorial_codes(5)
+    np.testing.assert_allclose(factorial_weights(5), scenario_weights(codes))
+    assert factorial_weights(0).tolist() == [1.0]
+    labels = level_labels(codes[:, 0])
+    assert labels.categories.tolist() == ["value_low", "value_mid", "value_high"]
+    assert labels[-1] == "value_high"
+
+
+def test_metalog_quantile():
+    from decision_analytics.metalogistic import MetaLogistic
+    from decision_analytics.simulation import metalog_quantile
+
+    metalog = MetaLogistic(cdf_xs=[2, 3, 10], cdf_ps=[0.1, 0.5, 0.9])
+    probabilities = np.array([0.01, 0.1, 0.5, 0.75, 0.9])
+    np.testing.assert_allclose(
+        metalog_quantile(metalog, probabilities),
+        [metalog.quantile(p) for p in probabilities],
+    )
+
+
+def test_sample_uniforms():
+    import pytest
+
+    from decision_analytics.simulation import sample_uniforms
+
+    for sampler in ["random", "sobol", "latin_hypercube"]:
+        uniforms = sample_uniforms(256, 3, sampler, seed=7)
+        assert uniforms.shape == (256, 3)
+        assert ((uniforms >= 0) & (uniforms < 1)).all()
+        np.testing.assert_array_equal(
+            uniforms, sample_uniforms(256, 3, sampler, seed=7)
+        )
+    # Latin hypercube samples have exactly one draw per stratum of each input
+    uniforms = sample_uniforms(100, 2, "latin_hypercube", seed=0)
+    for column in uniforms.T:
+        assert sorted((column * 100).astype(int)) == list(range(100))
+    with pytest.raises(ValueError):
+        sample_uniforms(10, 2, "grid")
+
+
+def test_sample_uniform_blocks():
+    import pytest
+
+    from decision_analytics.simulation import sample_uniform_blocks, sample_uniforms
+
+    for sampler in ["random", "sobol"]:
+        blocks = list(sample_uniform_blocks(1024, 3, sampler, seed=7, chunk_size=300))
+        assert all(len(block) <= 300 for _, block in blocks)
+        np.testing.assert_array_equal(
+            np.concatenate([block for _, block in blocks]),
+            sample_uniforms(1024, 3, sampler, seed=7),
+        )
+    with pytest.raises(ValueError):
+        sample_uniform_blocks(10, 2, "latin_hypercube")